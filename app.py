@@ -1,11 +1,13 @@
 import os
+import atexit
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import cv2
 import numpy as np
 import face_recognition
 import base64
 import threading
 import time
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -16,6 +18,17 @@ from datetime import datetime, timedelta
 from models import db, User, Establishment, Camera, KnownFace, Sighting
 from forms import LoginForm, RegisterForm, EstablishmentForm, CameraForm, FaceRegisterForm
 from face_recognition_engine import FaceRecognitionEngine
+from inference_batcher import InferenceBatcher
+from frame_ring import FrameRingBuffer
+from face_tracker import FaceTracker
+from motion_detector import MotionGate
+from detection_scheduler import DetectionScheduler
+from mjpeg_stream import MJPEGHub, BOUNDARY
+import detection_backend
+import sighting_writer
+import sighting_rollups
+import stats_cache
+import gallery_snapshot
 
 # Carrega variáveis de ambiente do .env
 load_dotenv()
@@ -27,6 +40,62 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 
+# Índice aproximado (IVF) para galerias grandes; abaixo de FACE_ANN_MIN_SIZE usa força bruta
+app.config['FACE_ANN_ENABLED'] = os.getenv('FACE_ANN_ENABLED', 'true').lower() == 'true'
+app.config['FACE_ANN_MIN_SIZE'] = int(os.getenv('FACE_ANN_MIN_SIZE', 5000))
+app.config['FACE_ANN_NLIST'] = int(os.getenv('FACE_ANN_NLIST', 0))  # 0 = automático
+app.config['FACE_ANN_NPROBE'] = int(os.getenv('FACE_ANN_NPROBE', 8))  # Maior = mais recall, mais lento
+
+# Estágio central de inferência: lotes de frames de todas as câmeras
+app.config['INFERENCE_BATCH_SIZE'] = int(os.getenv('INFERENCE_BATCH_SIZE', 8))
+app.config['INFERENCE_MAX_LATENCY_MS'] = int(os.getenv('INFERENCE_MAX_LATENCY_MS', 50))
+app.config['INFERENCE_WORKERS'] = int(os.getenv('INFERENCE_WORKERS', 0))  # 0 = número de núcleos
+app.config['INFERENCE_TIMEOUT_MS'] = int(os.getenv('INFERENCE_TIMEOUT_MS', 5000))  # Espera máxima por um resultado
+
+# Backend de detecção/encoding: 'local' (threads) ou 'process' (pool de processos, sem GIL)
+app.config['DETECTION_BACKEND'] = os.getenv('DETECTION_BACKEND', 'local')
+app.config['DETECTION_PROCESSES'] = int(os.getenv('DETECTION_PROCESSES', 0))  # 0 = núcleos - 1
+
+# Rastreador de rostos por câmera: re-encoda só trilhas novas, fracas ou a cada N passes
+app.config['FACE_TRACKER_ENABLED'] = os.getenv('FACE_TRACKER_ENABLED', 'true').lower() == 'true'
+app.config['FACE_TRACKER_REENCODE_INTERVAL'] = int(os.getenv('FACE_TRACKER_REENCODE_INTERVAL', 10))
+app.config['FACE_TRACKER_IOU'] = float(os.getenv('FACE_TRACKER_IOU', 0.3))
+
+# Filtro de movimento: cenas paradas não passam pela detecção
+app.config['MOTION_GATE_ENABLED'] = os.getenv('MOTION_GATE_ENABLED', 'true').lower() == 'true'
+app.config['MOTION_DEFAULT_THRESHOLD'] = float(os.getenv('MOTION_DEFAULT_THRESHOLD', 0.5))  # % de pixels
+
+# Escalonador adaptativo dos passes de detecção (substitui o intervalo fixo de 150ms)
+app.config['DETECTION_MIN_INTERVAL_MS'] = int(os.getenv('DETECTION_MIN_INTERVAL_MS', 100))
+app.config['DETECTION_MAX_INTERVAL_MS'] = int(os.getenv('DETECTION_MAX_INTERVAL_MS', 2000))
+app.config['DETECTION_CPU_BUDGET'] = float(os.getenv('DETECTION_CPU_BUDGET', 0))  # Núcleos; 0 = 80% da máquina
+
+# Detecção em dois estágios: escala da detecção pelo menor rosto esperado (px), encoding em recortes
+app.config['FACE_MIN_SIZE_PX'] = int(os.getenv('FACE_MIN_SIZE_PX', detection_backend.DEFAULT_MIN_FACE_SIZE))
+
+# Resultado do processamento: 'frame' (frame re-encodado com as detecções) ou
+# 'metadata' (só caixas/nomes/ids; o painel desenha as caixas no navegador)
+app.config['STREAM_RESULTS_MODE'] = os.getenv('STREAM_RESULTS_MODE', 'frame')
+
+# Gravação dos avistamentos em lote (write-behind): INSERT de várias linhas a cada
+# N avistamentos ou T ms; com a fila cheia aplica a política (drop_oldest, drop_new ou block)
+app.config['SIGHTING_BATCH_SIZE'] = int(os.getenv('SIGHTING_BATCH_SIZE', '200'))
+app.config['SIGHTING_FLUSH_MS'] = int(os.getenv('SIGHTING_FLUSH_MS', '500'))
+app.config['SIGHTING_QUEUE_SIZE'] = int(os.getenv('SIGHTING_QUEUE_SIZE', '10000'))
+app.config['SIGHTING_OVERFLOW'] = os.getenv('SIGHTING_OVERFLOW', 'drop_oldest')
+
+# Estatísticas do painel: cache por usuário invalidado nas escritas e enviado por push
+# ('stats_update' só com o que mudou); STATS_MAX_AGE_S recalcula mesmo sem escritas
+app.config['STATS_PUSH_INTERVAL_MS'] = int(os.getenv('STATS_PUSH_INTERVAL_MS', '1000'))
+app.config['STATS_MAX_AGE_S'] = int(os.getenv('STATS_MAX_AGE_S', '60'))
+
+# Snapshot em disco (memory-mapped) da galeria de cada usuário para partida rápida; vazio desativa
+app.config['GALLERY_SNAPSHOT_DIR'] = os.getenv('GALLERY_SNAPSHOT_DIR', 'gallery_snapshots')
+
+# Ring buffer de frames por câmera (shared=true usa multiprocessing.shared_memory)
+app.config['FRAME_RING_SLOTS'] = int(os.getenv('FRAME_RING_SLOTS', 8))
+app.config['FRAME_RING_SHARED'] = os.getenv('FRAME_RING_SHARED', 'false').lower() == 'true'
+
 # Inicializa extensões
 db.init_app(app)
 login_manager = LoginManager()
@@ -42,6 +111,92 @@ face_engines = {}
 active_cameras = {}  # Dicionário para rastrear câmeras ativas
 camera_threads = {}  # Threads de streaming das câmeras
 temp_face_cache = {}  # Cache temporário para rostos capturados
+camera_trackers = {}  # Rastreadores de rostos por câmera
+camera_motion_gates = {}  # Filtros de movimento por câmera
+last_stream_detections = {}  # Últimas detecções por câmera (reusadas quando o frame é filtrado)
+camera_viewers = {}  # camera_id -> sessões (sid) inscritas na sala camera_{id}
+viewers_lock = threading.Lock()
+mjpeg_hub = MJPEGHub()  # Espectadores HTTP (MJPEG) por câmera
+
+# Escalonador compartilhado dos passes de detecção de todas as câmeras
+detection_scheduler = DetectionScheduler(
+    min_interval=app.config['DETECTION_MIN_INTERVAL_MS'] / 1000.0,
+    max_interval=app.config['DETECTION_MAX_INTERVAL_MS'] / 1000.0,
+    cpu_budget=app.config['DETECTION_CPU_BUDGET'] or None
+)
+
+def get_camera_tracker(camera_id):
+    """Retorna o rastreador de rostos da câmera (None se desativado)"""
+    if not app.config['FACE_TRACKER_ENABLED']:
+        return None
+    if camera_id not in camera_trackers:
+        camera_trackers[camera_id] = FaceTracker(
+            iou_threshold=app.config['FACE_TRACKER_IOU'],
+            reencode_interval=app.config['FACE_TRACKER_REENCODE_INTERVAL']
+        )
+    return camera_trackers[camera_id]
+
+def mjpeg_overlay_jpeg(engine, frame, face_locations, face_names, scale_factor=1.0, quality=80):
+    """JPEG com as caixas desenhadas para os espectadores MJPEG (que não recebem os metadados)"""
+    display_frame = frame.copy()
+    engine.draw_detections(display_frame, face_locations, face_names, scale_factor)
+    _, buffer = cv2.imencode('.jpg', display_frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer
+
+def forget_stream_camera(camera_id):
+    """Descarta o estado de detecção de uma câmera alimentada pelo cliente que parou
+
+    Sem isso o escalonador continuaria somando a demanda dela e uma volta da
+    câmera reaproveitaria caixas antigas.
+    """
+    last_stream_detections.pop(camera_id, None)
+    detection_scheduler.unregister(camera_id)
+
+def get_motion_gate(camera):
+    """Retorna o filtro de movimento da câmera (None se desativado)"""
+    if not app.config['MOTION_GATE_ENABLED']:
+        return None
+    if camera.id not in camera_motion_gates:
+        threshold = camera.motion_threshold
+        if threshold is None:
+            threshold = app.config['MOTION_DEFAULT_THRESHOLD']
+        camera_motion_gates[camera.id] = MotionGate(threshold_percent=threshold)
+    return camera_motion_gates[camera.id]
+
+def add_camera_viewer(camera_id):
+    """Inscreve a sessão atual na sala da câmera"""
+    join_room(f"camera_{camera_id}")
+    with viewers_lock:
+        camera_viewers.setdefault(camera_id, set()).add(request.sid)
+
+def remove_camera_viewer(camera_id, sid):
+    """Remove uma sessão da sala da câmera"""
+    with viewers_lock:
+        viewers = camera_viewers.get(camera_id)
+        if viewers is not None:
+            viewers.discard(sid)
+            if not viewers:
+                del camera_viewers[camera_id]
+
+def camera_socket_viewers(camera_id):
+    """Quantas sessões Socket.IO estão na sala da câmera"""
+    with viewers_lock:
+        return len(camera_viewers.get(camera_id, ()))
+
+def camera_viewer_count(camera_id):
+    """Quantos navegadores estão assistindo a câmera (0 = só reconhecimento)"""
+    return camera_socket_viewers(camera_id) + mjpeg_hub.viewer_count(camera_id)
+
+def get_detection_scale(camera):
+    """Escala de detecção da câmera a partir do tamanho de rosto esperado"""
+    return detection_backend.detection_scale(camera.min_face_size or app.config['FACE_MIN_SIZE_PX'])
+
+# Batcher compartilhado: detecção/encoding de todas as câmeras passa por aqui
+inference_batcher = InferenceBatcher(
+    max_batch_size=app.config['INFERENCE_BATCH_SIZE'],
+    max_latency=app.config['INFERENCE_MAX_LATENCY_MS'] / 1000.0,
+    workers=app.config['INFERENCE_WORKERS'] or None
+)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -101,14 +256,8 @@ def dashboard():
     if selected_establishment:
         cameras = Camera.query.filter_by(establishment_id=selected_establishment.id).all()
     
-    # Estatísticas rápidas
-    stats = None
-    if current_user.id in face_engines:
-        stats = face_engines[current_user.id].get_statistics()
-    else:
-        # Carrega engine se não existir
-        face_engines[current_user.id] = FaceRecognitionEngine(current_user.id, app)
-        stats = face_engines[current_user.id].get_statistics()
+    # Estatísticas rápidas (do cache; o painel recebe as mudanças por 'stats_update')
+    stats = get_user_stats(current_user.id)
     
     return render_template('dashboard.html', 
                          establishments=establishments,
@@ -116,25 +265,54 @@ def dashboard():
                          cameras=cameras,
                          stats=stats)
 
+def compute_db_stats(user_id):
+    """Parte das estatísticas que depende do banco (fica no cache de estatísticas)"""
+    if user_id not in face_engines:
+        face_engines[user_id] = FaceRecognitionEngine(user_id, app)
+    
+    stats = face_engines[user_id].get_statistics()
+    stats['total_cameras'] = Camera.query.join(Establishment).filter(
+        Establishment.user_id == user_id
+    ).count()
+    return stats
+
+def compute_live_stats(user_id):
+    """Parte das estatísticas em memória (calculada a cada envio, sem banco)"""
+    return {'active_cameras': len([cam for cam in list(active_cameras.values())
+                                   if cam.get('user_id') == user_id])}
+
+def publish_stats(user_id, delta):
+    """Envia só as estatísticas que mudaram aos painéis do usuário"""
+    socketio.emit('stats_update', delta, room=f"user_{user_id}")
+
+def get_user_stats(user_id):
+    """Estatísticas do usuário (do cache quando configurado)"""
+    cache = stats_cache.get_cache()
+    if cache:
+        return cache.get(user_id)
+    stats = compute_db_stats(user_id)
+    stats.update(compute_live_stats(user_id))
+    return stats
+
 @app.route('/api/stats')
 @login_required
 def get_stats():
-    """API para obter estatísticas em tempo real"""
-    if current_user.id not in face_engines:
-        face_engines[current_user.id] = FaceRecognitionEngine(current_user.id, app)
-    
-    stats = face_engines[current_user.id].get_statistics()
-    
-    # Adiciona informações sobre câmeras ativas
-    user_cameras = Camera.query.join(Establishment).filter(
-        Establishment.user_id == current_user.id
-    ).count()
-    
-    stats['total_cameras'] = user_cameras
-    stats['active_cameras'] = len([cam for cam in active_cameras.values() 
-                                 if cam.get('user_id') == current_user.id])
-    
-    return jsonify(stats)
+    """API para obter estatísticas (o painel usa o push de 'stats_update')"""
+    return jsonify(get_user_stats(current_user.id))
+
+@app.route('/api/stats/timeseries')
+@login_required
+def get_stats_timeseries():
+    """Série por hora dos avistamentos (lida dos agregados), com filtros opcionais"""
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 31)
+    return jsonify({
+        'hours': sighting_rollups.hourly_series(
+            current_user.id, hours,
+            face_id=request.args.get('face_id', type=int),
+            camera_id=request.args.get('camera_id', type=int)
+        ),
+        'cameras': sighting_rollups.camera_totals(current_user.id, hours)
+    })
 
 @app.route('/establishments', methods=['GET', 'POST'])
 @login_required
@@ -174,6 +352,7 @@ def delete_establishment(id):
     establishment = Establishment.query.filter_by(id=id, user_id=current_user.id).first_or_404()
     db.session.delete(establishment)
     db.session.commit()
+    stats_cache.invalidate(current_user.id)  # Remove as câmeras e os avistamentos delas
     flash('Estabelecimento excluído com sucesso!')
     return redirect(url_for('manage_establishments'))
 
@@ -186,10 +365,13 @@ def manage_cameras():
         camera = Camera(
             name=form.name.data,
             camera_source=form.camera_source.data,
-            establishment_id=form.establishment_id.data
+            establishment_id=form.establishment_id.data,
+            motion_threshold=form.motion_threshold.data,
+            min_face_size=form.min_face_size.data
         )
         db.session.add(camera)
         db.session.commit()
+        stats_cache.invalidate(current_user.id)
         flash('Câmera criada com sucesso!')
         return redirect(url_for('manage_cameras'))
     
@@ -215,12 +397,29 @@ def edit_camera(id):
         camera.name = form.name.data
         camera.camera_source = form.camera_source.data
         camera.establishment_id = form.establishment_id.data
+        camera.motion_threshold = form.motion_threshold.data
+        camera.min_face_size = form.min_face_size.data
         db.session.commit()
+        # Aplica o novo limiar na próxima vez que o filtro de movimento for criado
+        camera_motion_gates.pop(camera.id, None)
         flash('Câmera atualizada com sucesso!')
         return redirect(url_for('manage_cameras'))
     
     return render_template('edit_camera.html', form=form, camera=camera)
 
+@app.route('/cameras/<int:id>/stream.mjpg')
+@login_required
+def camera_mjpeg(id):
+    """Stream MJPEG da câmera (cada espectador recebe só o frame mais recente)"""
+    camera = Camera.query.join(Establishment).filter(
+        Camera.id == id,
+        Establishment.user_id == current_user.id
+    ).first_or_404()
+    
+    return Response(mjpeg_hub.stream(camera.id),
+                    mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}',
+                    headers={'Cache-Control': 'no-cache'})
+
 @app.route('/cameras/<int:id>/delete')
 @login_required
 def delete_camera(id):
@@ -230,6 +429,7 @@ def delete_camera(id):
     ).first_or_404()
     db.session.delete(camera)
     db.session.commit()
+    stats_cache.invalidate(current_user.id)
     flash('Câmera excluída com sucesso!')
     return redirect(url_for('manage_cameras'))
 
@@ -340,35 +540,145 @@ def register_face():
 def delete_face(id):
     face = KnownFace.query.filter_by(id=id, user_id=current_user.id).first_or_404()
     db.session.delete(face)
+    version = gallery_snapshot.bump_version(db.session, current_user.id)
     db.session.commit()
+    stats_cache.invalidate(current_user.id)  # Mesmo sem engine carregado (avistamentos em cascata)
     
-    # Recarrega o engine
+    # Remove da galeria em memória do engine (sem recarga completa)
     if current_user.id in face_engines:
-        face_engines[current_user.id].load_known_faces()
+        face_engines[current_user.id].remove_known_face(id, version)
     
     flash('Rosto excluído com sucesso!')
     return redirect(url_for('manage_faces'))
 
-@app.route('/sightings')
-@login_required
-def view_sightings():
-    """Visualizar histórico de avistamentos"""
-    page = request.args.get('page', 1, type=int)
-    
-    # Query com joins para pegar dados relacionados
-    sightings = db.session.query(Sighting, KnownFace, Camera, Establishment).join(
+def encode_sighting_cursor(sighting):
+    """Cursor opaco da paginação: posição (timestamp, id) de um avistamento"""
+    return f"{sighting.timestamp.strftime('%Y%m%d%H%M%S%f')}_{sighting.id}"
+
+def decode_sighting_cursor(cursor):
+    """Inverso de encode_sighting_cursor; None se o cursor for inválido"""
+    try:
+        timestamp, sighting_id = cursor.split('_', 1)
+        return datetime.strptime(timestamp, '%Y%m%d%H%M%S%f'), int(sighting_id)
+    except (AttributeError, ValueError):
+        return None
+
+def query_sightings_page(user_id, before=None, after=None, limit=20, face_id=None, camera_id=None):
+    """Página do histórico por cursor (keyset), do mais recente para o mais antigo
+
+    Em vez de OFFSET, continua a partir da posição (timestamp, id) do último item
+    visto, percorrendo o índice de timestamp: a página N custa o mesmo que a 1.
+    Retorna (linhas, cursor da próxima página, cursor da página anterior).
+    """
+    query = db.session.query(Sighting, KnownFace, Camera, Establishment).join(
         KnownFace, Sighting.face_id == KnownFace.id
     ).join(
         Camera, Sighting.camera_id == Camera.id
     ).join(
         Establishment, Camera.establishment_id == Establishment.id
     ).filter(
-        KnownFace.user_id == current_user.id
-    ).order_by(
-        Sighting.timestamp.desc()
-    ).paginate(per_page=20, page=page, error_out=False)
+        KnownFace.user_id == user_id
+    )
+    if face_id is not None:
+        query = query.filter(Sighting.face_id == face_id)
+    if camera_id is not None:
+        query = query.filter(Sighting.camera_id == camera_id)
+    
+    after_position = decode_sighting_cursor(after) if after else None
+    before_position = decode_sighting_cursor(before) if before else None
+    
+    if after_position:
+        # Página anterior: caminha no sentido crescente e inverte no final
+        timestamp, sighting_id = after_position
+        query = query.filter(db.or_(
+            Sighting.timestamp > timestamp,
+            db.and_(Sighting.timestamp == timestamp, Sighting.id > sighting_id)
+        )).order_by(Sighting.timestamp.asc(), Sighting.id.asc())
+    else:
+        if before_position:
+            timestamp, sighting_id = before_position
+            query = query.filter(db.or_(
+                Sighting.timestamp < timestamp,
+                db.and_(Sighting.timestamp == timestamp, Sighting.id < sighting_id)
+            ))
+        query = query.order_by(Sighting.timestamp.desc(), Sighting.id.desc())
+    
+    # Um item a mais indica se existe outra página nesse sentido
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    if after_position:
+        rows.reverse()
+        next_cursor = encode_sighting_cursor(rows[-1][0]) if rows else after
+        prev_cursor = encode_sighting_cursor(rows[0][0]) if rows and has_more else None
+    else:
+        next_cursor = encode_sighting_cursor(rows[-1][0]) if rows and has_more else None
+        prev_cursor = encode_sighting_cursor(rows[0][0]) if rows and before_position else None
     
-    return render_template('sightings.html', sightings=sightings)
+    return rows, next_cursor, prev_cursor
+
+@app.route('/sightings')
+@login_required
+def view_sightings():
+    """Visualizar histórico de avistamentos"""
+    # Paginação por número de página (OFFSET) mantida para links antigos
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        
+        # Query com joins para pegar dados relacionados
+        sightings = db.session.query(Sighting, KnownFace, Camera, Establishment).join(
+            KnownFace, Sighting.face_id == KnownFace.id
+        ).join(
+            Camera, Sighting.camera_id == Camera.id
+        ).join(
+            Establishment, Camera.establishment_id == Establishment.id
+        ).filter(
+            KnownFace.user_id == current_user.id
+        ).order_by(
+            Sighting.timestamp.desc()
+        ).paginate(per_page=20, page=page, error_out=False)
+        
+        return render_template('sightings.html', sightings=sightings)
+    
+    rows, next_cursor, prev_cursor = query_sightings_page(
+        current_user.id,
+        before=request.args.get('before'),
+        after=request.args.get('after')
+    )
+    return render_template('sightings.html', rows=rows, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+@app.route('/api/sightings')
+@login_required
+def api_sightings():
+    """API do histórico com paginação por cursor (?before=, ?after=, ?limit=, ?face_id=, ?camera_id=)"""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    rows, next_cursor, prev_cursor = query_sightings_page(
+        current_user.id,
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        limit=limit,
+        face_id=request.args.get('face_id', type=int),
+        camera_id=request.args.get('camera_id', type=int)
+    )
+    
+    return jsonify({
+        'sightings': [
+            {
+                'id': sighting.id,
+                'timestamp': sighting.timestamp.isoformat(),
+                'face_id': face.id,
+                'face_name': face.name,
+                'camera_id': camera.id,
+                'camera_name': camera.name,
+                'establishment_id': establishment.id,
+                'establishment_name': establishment.name
+            }
+            for sighting, face, camera, establishment in rows
+        ],
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor
+    })
 
 # --- SOCKET.IO ---
 @socketio.on('connect')
@@ -382,8 +692,9 @@ def handle_connect(auth):
         if current_user.id not in face_engines:
             face_engines[current_user.id] = FaceRecognitionEngine(current_user.id, app)
         
-        # Envia estatísticas iniciais
-        stats = face_engines[current_user.id].get_statistics()
+        # Envia estatísticas iniciais; as mudanças seguintes chegam por push
+        cache = stats_cache.get_cache()
+        stats = cache.subscribe(current_user.id) if cache else get_user_stats(current_user.id)
         emit('stats_update', stats)
 
 @socketio.on('disconnect')
@@ -393,6 +704,16 @@ def handle_disconnect():
         leave_room(f"user_{current_user.id}")
         print(f'Cliente {current_user.username} desconectado (Session: {request.sid})!')
         
+        cache = stats_cache.get_cache()
+        if cache:
+            cache.unsubscribe(current_user.id)
+        
+        # Sai das salas das câmeras que esta sessão assistia
+        with viewers_lock:
+            watched = [cam_id for cam_id, sids in camera_viewers.items() if request.sid in sids]
+        for cam_id in watched:
+            remove_camera_viewer(cam_id, request.sid)
+        
         # Remove câmeras ativas deste usuário
         cameras_to_remove = [cam_id for cam_id, cam_info in active_cameras.items() 
                            if cam_info.get('user_id') == current_user.id and 
@@ -400,20 +721,27 @@ def handle_disconnect():
         
         for cam_id in cameras_to_remove:
             del active_cameras[cam_id]
+            forget_stream_camera(cam_id)
 
 @socketio.on('stream')
 def handle_stream(data):
-    """Processa stream de vídeo"""
+    """Processa stream de vídeo
+
+    O retorno é o ack do frame: o camera_client só libera o crédito para o
+    próximo envio quando recebe a confirmação (controle de fluxo).
+    """
+    ack = {'sequence': data.get('sequence'), 'processed': False}
+    
     if not current_user.is_authenticated:
         emit('error', {'message': 'Usuário não autenticado'})
-        return
+        return ack
     
     image_data = data.get('image')
     camera_id = data.get('camera_id')
     
     if not image_data or not camera_id:
         emit('error', {'message': 'Dados inválidos'})
-        return
+        return ack
     
     # Verifica se a câmera pertence ao usuário
     camera = Camera.query.join(Establishment).filter(
@@ -423,7 +751,7 @@ def handle_stream(data):
     
     if not camera:
         emit('error', {'message': 'Câmera não autorizada'})
-        return
+        return ack
     
     # Garante que o engine está carregado
     if current_user.id not in face_engines:
@@ -432,38 +760,99 @@ def handle_stream(data):
     engine = face_engines[current_user.id]
     
     try:
-        # Decodifica imagem
-        header, encoded = image_data.split(",", 1)
-        decoded_image = base64.b64decode(encoded)
-        frame = cv2.imdecode(np.frombuffer(decoded_image, np.uint8), 1)
+        # Decodifica imagem: JPEG binário (anexo Socket.IO) ou data URL Base64 (formato antigo)
+        if isinstance(image_data, (bytes, bytearray, memoryview)):
+            jpeg_bytes = bytes(image_data)
+            frame = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+        else:
+            header, encoded = image_data.split(",", 1)
+            jpeg_bytes = base64.b64decode(encoded)
+            frame = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), 1)
         
         if frame is None:
             emit('error', {'message': 'Frame inválido'})
-            return
+            return ack
         
-        # Processa frame
-        processed_frame, face_names, face_ids = engine.process_frame(frame, camera_id)
+        # Processa frame no estágio central de inferência (em lote com as outras câmeras),
+        # a menos que o filtro de movimento indique cena parada
+        # ou o escalonador ainda não liberou o próximo passe desta câmera
+        motion_gate = get_motion_gate(camera)
+        run_detection = camera_id not in last_stream_detections
+        if not run_detection and detection_scheduler.due(camera_id):
+            run_detection = motion_gate is None or motion_gate.should_process(frame)
+            if not run_detection:
+                detection_scheduler.start(camera_id)
+                detection_scheduler.record_skip(camera_id)
         
-        # Codifica frame processado com qualidade otimizada
-        _, buffer = cv2.imencode('.jpg', processed_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        processed_image_data = base64.b64encode(buffer).decode('utf-8')
+        if run_detection:
+            detection_scheduler.start(camera_id)
+            try:
+                face_locations, face_names, face_ids = inference_batcher.submit(
+                    camera_id, engine, frame, tracker=get_camera_tracker(camera_id),
+                    scale_factor=get_detection_scale(camera)
+                ).result(timeout=app.config['INFERENCE_TIMEOUT_MS'] / 1000.0)
+            except FutureTimeoutError:
+                # Detecção não respondeu a tempo: trata como frame não processado
+                print(f"Tempo esgotado na detecção da câmera {camera_id}")
+                return ack
+            detection_scheduler.record(camera_id, inference_batcher.detection_time(camera_id), len(face_names))
+            last_stream_detections[camera_id] = (face_locations, face_names, face_ids)
+        else:
+            face_locations, face_names, face_ids = last_stream_detections[camera_id]
         
         # Atualiza info da câmera ativa
         active_cameras[camera_id] = {
             'user_id': current_user.id,
             'session_id': request.sid,
             'last_update': datetime.utcnow(),
-            'face_count': len(face_names)
+            'face_count': len(face_names),
+            'skipped_detections': motion_gate.stats['skipped'] if motion_gate else 0
         }
         
-        # Envia de volta para o cliente
-        emit('processed_frame', {
-            'camera_id': camera_id,
-            'image': processed_image_data,
-            'faces': face_names,
-            'face_count': len(face_names),
-            'timestamp': datetime.utcnow().isoformat()
-        }, room=f"user_{current_user.id}")
+        # Sem ninguém assistindo, fica só o reconhecimento (avistamentos já foram registrados)
+        results_mode = data.get('results', app.config['STREAM_RESULTS_MODE'])
+        if camera_viewer_count(camera_id) == 0:
+            pass
+        elif results_mode == 'metadata':
+            # Só metadados: o painel desenha as caixas no navegador. O frame vai
+            # adiante com os bytes JPEG que o cliente enviou, sem re-encodar.
+            # O MJPEG não recebe metadados: com rostos, ganha um JPEG próprio com as caixas.
+            if mjpeg_hub.viewer_count(camera_id) > 0:
+                mjpeg_hub.publish(camera_id, mjpeg_overlay_jpeg(engine, frame, face_locations, face_names)
+                                  if face_names else jpeg_bytes)
+            emit('camera_frame', {
+                'camera_id': camera_id,
+                'sequence': data.get('sequence'),
+                'image': jpeg_bytes
+            }, room=f"camera_{camera_id}")
+            emit('frame_detections', {
+                'camera_id': camera_id,
+                'sequence': data.get('sequence'),
+                'faces': face_names,
+                'ids': face_ids,
+                'locations': [list(location) for location in face_locations],
+                'frame_width': frame.shape[1],
+                'frame_height': frame.shape[0],
+                'face_count': len(face_names),
+                'capture_timestamp': data.get('timestamp'),
+                'timestamp': datetime.utcnow().isoformat()
+            }, room=f"camera_{camera_id}")
+        else:
+            # Codifica frame processado com qualidade otimizada
+            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            mjpeg_hub.publish(camera_id, buffer)
+            
+            # Envia só para quem assiste esta câmera
+            processed_image_data = base64.b64encode(buffer).decode('utf-8')
+            emit('processed_frame', {
+                'camera_id': camera_id,
+                'image': processed_image_data,
+                'faces': face_names,
+                'face_count': len(face_names),
+                'sequence': data.get('sequence'),
+                'capture_timestamp': data.get('timestamp'),
+                'timestamp': datetime.utcnow().isoformat()
+            }, room=f"camera_{camera_id}")
         
         # Se rostos foram detectados, emite notificação
         if face_names:
@@ -475,9 +864,115 @@ def handle_stream(data):
                 'timestamp': datetime.utcnow().isoformat()
             }, room=f"user_{current_user.id}")
         
+        ack['processed'] = True
+        
     except Exception as e:
         print(f"Erro no processamento do stream: {e}")
         emit('error', {'message': f'Erro no processamento: {str(e)}'})
+    
+    return ack
+
+@socketio.on('detections')
+def handle_detections(data):
+    """Recebe detecções já encodadas por um camera_client em modo edge
+
+    O servidor só casa os encodings com a galeria e registra os avistamentos;
+    a prévia de baixa resolução (opcional) é repassada sem re-encodar.
+    """
+    ack = {'sequence': data.get('sequence'), 'processed': False}
+    
+    if not current_user.is_authenticated:
+        emit('error', {'message': 'Usuário não autenticado'})
+        return ack
+    
+    camera_id = data.get('camera_id')
+    camera = Camera.query.join(Establishment).filter(
+        Camera.id == camera_id,
+        Establishment.user_id == current_user.id
+    ).first()
+    
+    if not camera:
+        emit('error', {'message': 'Câmera não autorizada'})
+        return ack
+    
+    if current_user.id not in face_engines:
+        face_engines[current_user.id] = FaceRecognitionEngine(current_user.id, app)
+    
+    engine = face_engines[current_user.id]
+    
+    try:
+        # Encodings: float32 binário (512 bytes por rosto) ou lista de listas (transporte base64)
+        raw_encodings = data.get('encodings') or []
+        if isinstance(raw_encodings, (bytes, bytearray, memoryview)):
+            face_encodings = np.frombuffer(raw_encodings, dtype=np.float32).reshape(-1, 128)
+        else:
+            face_encodings = np.asarray(raw_encodings, dtype=np.float32).reshape(-1, 128)
+        face_locations = [tuple(location) for location in data.get('locations') or []]
+        
+        if len(face_locations) != len(face_encodings):
+            emit('error', {'message': 'Detecções inválidas'})
+            return ack
+        
+        face_names, face_ids, _ = engine.identify_many([(list(face_encodings), camera_id)])[0]
+        last_stream_detections[camera_id] = (face_locations, face_names, face_ids)
+        
+        active_cameras[camera_id] = {
+            'user_id': current_user.id,
+            'session_id': request.sid,
+            'last_update': datetime.utcnow(),
+            'face_count': len(face_names),
+            'mode': 'edge'
+        }
+        
+        if camera_viewer_count(camera_id) > 0:
+            preview = data.get('preview')
+            if isinstance(preview, str):
+                preview = base64.b64decode(preview.split(",", 1)[-1])
+            if preview:
+                if face_names and data.get('frame_width') and mjpeg_hub.viewer_count(camera_id) > 0:
+                    # Prévia reduzida: as localizações vêm na resolução cheia do frame
+                    preview_frame = cv2.imdecode(np.frombuffer(preview, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    scale = data['frame_width'] / preview_frame.shape[1]
+                    mjpeg_hub.publish(camera_id, mjpeg_overlay_jpeg(engine, preview_frame, face_locations,
+                                                                    face_names, scale_factor=scale))
+                else:
+                    mjpeg_hub.publish(camera_id, preview)
+                emit('camera_frame', {
+                    'camera_id': camera_id,
+                    'sequence': data.get('sequence'),
+                    'image': bytes(preview)
+                }, room=f"camera_{camera_id}")
+            
+            # Caixas nas coordenadas do frame original; o painel escala para a prévia
+            emit('frame_detections', {
+                'camera_id': camera_id,
+                'sequence': data.get('sequence'),
+                'faces': face_names,
+                'ids': face_ids,
+                'locations': [list(location) for location in face_locations],
+                'frame_width': data.get('frame_width'),
+                'frame_height': data.get('frame_height'),
+                'face_count': len(face_names),
+                'capture_timestamp': data.get('timestamp'),
+                'timestamp': datetime.utcnow().isoformat()
+            }, room=f"camera_{camera_id}")
+        
+        if face_names:
+            emit('face_detected', {
+                'camera_id': camera_id,
+                'camera_name': camera.name,
+                'establishment_name': camera.establishment.name,
+                'faces': face_names,
+                'timestamp': datetime.utcnow().isoformat()
+            }, room=f"user_{current_user.id}")
+        
+        ack['processed'] = True
+        
+    except Exception as e:
+        print(f"Erro no processamento das detecções: {e}")
+        emit('error', {'message': f'Erro no processamento: {str(e)}'})
+    
+    return ack
 
 @socketio.on('start_camera')
 def handle_start_camera(data):
@@ -492,7 +987,8 @@ def handle_start_camera(data):
     ).first()
     
     if camera:
-        join_room(f"camera_{camera_id}")
+        # Não inscreve a sessão como espectadora: quem inicia pode ser o próprio produtor
+        # (camera_client); só 'watch_camera' (o painel) conta como espectador
         active_cameras[camera_id] = {
             'user_id': current_user.id,
             'session_id': request.sid,
@@ -500,8 +996,9 @@ def handle_start_camera(data):
             'face_count': 0
         }
         
-        # Inicia thread de streaming se não estiver já rodando
-        if camera_id not in camera_threads:
+        # Inicia thread de streaming se não estiver já rodando (câmeras alimentadas pelo
+        # cliente em modo edge já chegam detectadas: sem thread nem detecção central)
+        if not data.get('client_driven') and camera_id not in camera_threads:
             camera_threads[camera_id] = {'stop': False}
             thread = threading.Thread(target=stream_camera, args=(camera_id, current_user.id), daemon=True)
             thread.start()
@@ -520,19 +1017,41 @@ def handle_stop_camera(data):
     
     if camera_id in active_cameras:
         del active_cameras[camera_id]
+    forget_stream_camera(camera_id)
     
     # Para a thread de streaming
     if camera_id in camera_threads:
         camera_threads[camera_id]['stop'] = True
         del camera_threads[camera_id]
     
-    leave_room(f"camera_{camera_id}")
     emit('camera_stopped', {
         'camera_id': camera_id,
         'message': f'Câmera {camera_id} parada'
     })
     print(f"Câmera {camera_id} parada pelo usuário {current_user.username if current_user.is_authenticated else 'Anônimo'}")
 
+@socketio.on('watch_camera')
+def handle_watch_camera(data):
+    """Passa a receber os frames de uma câmera (sem iniciar a captura)"""
+    if not current_user.is_authenticated:
+        return
+    
+    camera_id = data.get('camera_id')
+    camera = Camera.query.join(Establishment).filter(
+        Camera.id == camera_id,
+        Establishment.user_id == current_user.id
+    ).first()
+    
+    if camera:
+        add_camera_viewer(camera_id)
+
+@socketio.on('unwatch_camera')
+def handle_unwatch_camera(data):
+    """Deixa de receber os frames de uma câmera"""
+    camera_id = data.get('camera_id')
+    leave_room(f"camera_{camera_id}")
+    remove_camera_viewer(camera_id, request.sid)
+
 @socketio.on('get_active_cameras')
 def handle_get_active_cameras():
     """Retorna lista de câmeras ativas do usuário"""
@@ -543,7 +1062,9 @@ def handle_get_active_cameras():
         {
             'camera_id': cam_id,
             'last_update': cam_info['last_update'].isoformat(),
-            'face_count': cam_info['face_count']
+            'face_count': cam_info['face_count'],
+            'skipped_detections': cam_info.get('skipped_detections', 0),
+            'detection_interval': cam_info.get('detection_interval')
         }
         for cam_id, cam_info in active_cameras.items()
         if cam_info.get('user_id') == current_user.id
@@ -563,6 +1084,7 @@ def cleanup_inactive_cameras():
         
         for cam_id in cameras_to_remove:
             del active_cameras[cam_id]
+            forget_stream_camera(cam_id)
             # Para também a thread de streaming se existir
             if cam_id in camera_threads:
                 camera_threads[cam_id]['stop'] = True
@@ -618,50 +1140,68 @@ def stream_camera(camera_id, user_id):
                 face_engines[user_id] = FaceRecognitionEngine(user_id, app)
             
             engine = face_engines[user_id]
+            tracker = get_camera_tracker(camera_id)
+            motion_gate = get_motion_gate(camera)
+            detection_scale = get_detection_scale(camera)
             frame_count = 0
             consecutive_failures = 0
             max_failures = 3
             
             # Sistema de threading para processamento paralelo
-            latest_frame = None
+            # Ring buffer pré-alocado: a captura escreve direto nos slots e a detecção lê sem copiar
+            frame_ring = None
             latest_detections = {'faces': [], 'ids': [], 'locations': []}
             frame_lock = threading.Lock()
             processing_active = True
             
             def face_detection_worker():
                 """Worker thread para processar detecção de rostos em paralelo"""
-                nonlocal latest_frame, latest_detections, processing_active
+                nonlocal latest_detections, processing_active
+                last_sequence = None
                 
                 while processing_active and camera_id in active_cameras:
                     try:
-                        with frame_lock:
-                            current_frame = latest_frame.copy() if latest_frame is not None else None
+                        sequence, current_frame = (frame_ring.read_latest() if frame_ring is not None
+                                                   else (None, None))
                         
-                        if current_frame is not None:
-                            # Usa o engine diretamente para processar o frame
-                            # Isso garante que toda a lógica de identificação funcione
-                            processed_frame, face_names, face_ids = engine.process_frame(current_frame, camera_id)
+                        # Só processa quando há um frame novo
+                        if current_frame is not None and sequence != last_sequence:
+                            last_sequence = sequence
+                            # A captura continua escrevendo no ring (8 slots, ~250 ms a 30 fps) enquanto a
+                            # detecção roda: copia o slot e confere que ele não foi sobrescrito durante a cópia
+                            current_frame = current_frame.copy()
+                            if not frame_ring.is_valid(sequence):
+                                continue
+                            detection_scheduler.start(camera_id)
                             
-                            # Extrai as localizações dos rostos se disponível
-                            face_locations = []
-                            if hasattr(engine, 'last_face_locations') and engine.last_face_locations:
-                                face_locations = engine.last_face_locations.copy()
+                            # Filtro de movimento: cena parada não passa pela detecção
+                            if motion_gate is not None and not motion_gate.should_process(current_frame):
+                                detection_scheduler.record_skip(camera_id)
+                                if camera_id in active_cameras:
+                                    active_cameras[camera_id]['skipped_detections'] = motion_gate.stats['skipped']
                             else:
-                                # Fallback: detecta localizações básicas
-                                small_frame = cv2.resize(current_frame, (0, 0), fx=0.25, fy=0.25)
-                                rgb_small_frame = small_frame[:, :, ::-1]
-                                locations = face_recognition.face_locations(rgb_small_frame)
-                                # Escala de volta para tamanho original
-                                face_locations = [(top*4, right*4, bottom*4, left*4) 
-                                                for top, right, bottom, left in locations]
-                            
-                            # Atualiza detecções thread-safe
-                            with frame_lock:
-                                latest_detections['faces'] = face_names.copy()
-                                latest_detections['ids'] = face_ids.copy()
-                                latest_detections['locations'] = face_locations.copy()
+                                # Envia o frame ao batcher central, que junta frames de todas as câmeras
+                                # e devolve localizações, nomes e ids deste frame
+                                face_locations, face_names, face_ids = inference_batcher.submit(
+                                    camera_id, engine, current_frame, tracker=tracker,
+                                    scale_factor=detection_scale
+                                ).result(timeout=app.config['INFERENCE_TIMEOUT_MS'] / 1000.0)
+                                detection_scheduler.record(camera_id, inference_batcher.detection_time(camera_id), len(face_names))
+                                
+                                # Atualiza detecções thread-safe
+                                with frame_lock:
+                                    latest_detections['faces'] = face_names.copy()
+                                    latest_detections['ids'] = face_ids.copy()
+                                    latest_detections['locations'] = list(face_locations)
+                        
+                        if camera_id in active_cameras:
+                            active_cameras[camera_id]['detection_interval'] = detection_scheduler.next_interval(camera_id)
                         
-                        time.sleep(0.15)  # Processa detecção a cada 150ms (mais estável)
+                        # Intervalo adaptativo: atividade da câmera, latência medida e orçamento global de CPU
+                        time.sleep(max(detection_scheduler.delay(camera_id), 0.02))
+                    except FutureTimeoutError:
+                        # Detecção não respondeu a tempo: mantém as últimas detecções e segue
+                        print(f"Tempo esgotado na detecção da câmera {camera_id}")
                     except Exception as e:
                         print(f"Erro no worker de detecção: {e}")
                         time.sleep(0.5)
@@ -680,7 +1220,12 @@ def stream_camera(camera_id, user_id):
                     time.sleep(1)
                     continue
                 
-                ret, frame = cap.read()
+                # Captura direto no próximo slot do ring buffer (sem alocar um frame novo)
+                if frame_ring is not None:
+                    sequence, slot = frame_ring.next_slot()
+                    ret, frame = cap.read(slot)
+                else:
+                    ret, frame = cap.read()
                 if not ret:
                     consecutive_failures += 1
                     print(f"Erro na captura do frame da câmera {camera_id} (falhas: {consecutive_failures})")
@@ -714,20 +1259,47 @@ def stream_camera(camera_id, user_id):
                 consecutive_failures = 0
                 
                 try:
-                    # Atualiza frame para thread de detecção
+                    # Publica o frame para a thread de detecção
+                    if frame_ring is None:
+                        frame_ring = FrameRingBuffer(frame.shape, frame.dtype,
+                                                     slots=app.config['FRAME_RING_SLOTS'],
+                                                     shared=app.config['FRAME_RING_SHARED'])
+                        active_cameras.get(camera_id, {})['frame_ring'] = frame_ring.name
+                        frame_ring.write(frame)
+                    elif np.may_share_memory(frame, slot):
+                        frame_ring.commit(sequence)
+                    else:
+                        # Resolução mudou (ex: reconexão): ajusta para o tamanho do slot
+                        cv2.resize(frame, (frame_ring.shape[1], frame_ring.shape[0]), dst=slot)
+                        frame = slot
+                        frame_ring.commit(sequence)
+                    
                     with frame_lock:
-                        latest_frame = frame.copy()
                         # Pega as últimas detecções disponíveis
                         current_faces = latest_detections['faces'].copy()
                         current_ids = latest_detections['ids'].copy()
                         current_locations = latest_detections['locations'].copy()
                     
-                    # SEMPRE envia o frame atual (stream contínua)
+                    # Ninguém assistindo: sem desenho, encode ou envio; a thread de
+                    # detecção continua reconhecendo e registrando avistamentos
+                    if camera_viewer_count(camera_id) == 0:
+                        if camera_id in active_cameras:
+                            active_cameras[camera_id]['last_update'] = datetime.utcnow()
+                            active_cameras[camera_id]['face_count'] = len(current_faces)
+                        frame_count += 1
+                        time.sleep(0.025)
+                        continue
+                    
+                    # Envia o frame atual para quem assiste (stream contínua)
                     # Mas desenha as detecções mais recentes sobre ele
-                    display_frame = frame.copy()
+                    # (cópia só quando há o que desenhar, para não sujar o slot lido pela detecção)
+                    display_frame = frame
+                    draw_overlay = app.config['STREAM_RESULTS_MODE'] != 'metadata'
                     
                     # Se há detecções, desenha os contornos no frame atual
-                    if len(current_faces) > 0 and len(current_locations) > 0:
+                    # (no modo 'metadata' quem desenha é o painel, sobre o próprio frame)
+                    if draw_overlay and len(current_faces) > 0 and len(current_locations) > 0:
+                        display_frame = frame.copy()
                         # Desenha retângulos e nomes para cada rosto detectado
                         for i, (name, location) in enumerate(zip(current_faces, current_locations)):
                             if i < len(current_locations):
@@ -755,9 +1327,13 @@ def stream_camera(camera_id, user_id):
                                 cv2.rectangle(display_frame, (left, top - 20), (left + 80, top), color, cv2.FILLED)
                                 cv2.putText(display_frame, confidence_text, (left + 2, top - 5), font, 0.4, (255, 255, 255), 1)
                     
-                    # Converte frame para base64 - frame com contornos
+                    # Codifica uma única vez: o mesmo JPEG vai para MJPEG e Socket.IO
                     _, buffer = cv2.imencode('.jpg', display_frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                    frame_base64 = base64.b64encode(buffer).decode('utf-8')
+                    if not draw_overlay and len(current_faces) > 0 and mjpeg_hub.viewer_count(camera_id) > 0:
+                        # Modo 'metadata': o MJPEG não desenha no navegador, recebe um JPEG com as caixas
+                        mjpeg_hub.publish(camera_id, mjpeg_overlay_jpeg(engine, frame, current_locations, current_faces))
+                    else:
+                        mjpeg_hub.publish(camera_id, buffer)
                     
                     # Atualiza informações da câmera ativa
                     if camera_id in active_cameras:
@@ -765,12 +1341,17 @@ def stream_camera(camera_id, user_id):
                         active_cameras[camera_id]['face_count'] = len(current_faces)
                     
                     # Envia frame via Socket.IO com detecções mais recentes
-                    socketio.emit('processed_frame', {
-                        'camera_id': camera_id,
-                        'image': frame_base64,
-                        'faces': current_faces,
-                        'face_count': len(current_faces)
-                    }, room=f"camera_{camera_id}")
+                    if camera_socket_viewers(camera_id) > 0:
+                        socketio.emit('processed_frame', {
+                            'camera_id': camera_id,
+                            'image': base64.b64encode(buffer).decode('utf-8'),
+                            'faces': current_faces,
+                            'face_count': len(current_faces),
+                            'locations': [list(location) for location in current_locations],
+                            'frame_width': frame.shape[1],
+                            'frame_height': frame.shape[0],
+                            'overlay': draw_overlay
+                        }, room=f"camera_{camera_id}")
                     
                     frame_count += 1
                     time.sleep(0.025)  # ~40 FPS para máxima fluidez
@@ -788,19 +1369,34 @@ def stream_camera(camera_id, user_id):
             processing_active = False
             if 'detection_thread' in locals():
                 detection_thread.join(timeout=1)
+            detection_scheduler.unregister(camera_id)
             
             # Limpa recursos
             if cap:
                 cap.release()
+            if 'frame_ring' in locals() and frame_ring is not None:
+                try:
+                    frame_ring.close()
+                except BufferError:
+                    print(f"Ring buffer da câmera {camera_id} ainda em uso; memória liberada ao sair")
             if camera_id in camera_threads:
                 del camera_threads[camera_id]
 
+def save_gallery_snapshots():
+    """Grava o snapshot das galerias que mudaram (em lote, fora do caminho das detecções)"""
+    for engine in list(face_engines.values()):
+        try:
+            engine.save_snapshot()
+        except Exception as e:
+            print(f"Erro ao gravar snapshot da galeria do usuário {engine.user_id}: {e}")
+
 # Executa limpeza a cada 2 minutos
 def start_cleanup_thread():
     def cleanup_loop():
         while True:
             time.sleep(120)  # 2 minutos
             cleanup_inactive_cameras()
+            save_gallery_snapshots()
     
     cleanup_thread = threading.Thread(target=cleanup_loop, daemon=True)
     cleanup_thread.start()
@@ -813,9 +1409,26 @@ def create_tables():
         db.create_all()
 
 if __name__ == '__main__':
+    debug = True
+    # Com o reloader, este bloco roda no processo vigia e no filho que atende;
+    # só o filho (WERKZEUG_RUN_MAIN) precisa do pool de processos
+    serving_process = not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if serving_process:
+        # O pool de processos precisa ser criado antes de qualquer thread (fork com os modelos carregados)
+        detection_backend.configure_backend(
+            app.config['DETECTION_BACKEND'],
+            app.config['DETECTION_PROCESSES'] or None
+        )
     create_tables()
+    sighting_writer.configure_writer(app)  # Grava a fila restante ao encerrar
+    stats_cache.configure_cache(
+        app, compute_db_stats, compute_live_stats, publish_stats,
+        push_interval=app.config['STATS_PUSH_INTERVAL_MS'] / 1000.0,
+        max_age=app.config['STATS_MAX_AGE_S']
+    )
     start_cleanup_thread()  # Inicia thread de limpeza
+    atexit.register(save_gallery_snapshots)
     print("🚀 Iniciando Sistema de Reconhecimento Facial...")
     print("📊 Dashboard: http://localhost:5000")
     print("⚠️  Para usar câmeras, execute também o camera_client.py")
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    socketio.run(app, debug=debug, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+Reconstrói os agregados por hora dos avistamentos (sighting_rollups_hourly)
+Execute depois de criar a tabela em um banco existente, ou para corrigir os
+agregados de um período:
+
+    python backfill_rollups.py                    # Tudo
+    python backfill_rollups.py --since 2024-01-01 # Só a partir da data
+
+Rode com o servidor parado: avistamentos gravados durante a reconstrução
+seriam contados duas vezes (pelo gravador e pela varredura).
+"""
+
+import argparse
+from datetime import datetime
+
+from app import app
+from models import db
+import sighting_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconstrói os agregados por hora dos avistamentos')
+    parser.add_argument('--since', default=None,
+                       help='Data inicial (AAAA-MM-DD ou AAAA-MM-DDTHH:MM); padrão: todos os avistamentos')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                       help='Avistamentos lidos por bloco (padrão: 50000)')
+    args = parser.parse_args()
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+
+    with app.app_context():
+        db.create_all()  # Cria a tabela de agregados se ainda não existir
+        print(f"Reconstruindo agregados {'desde ' + since.isoformat() if since else 'de todo o histórico'}...")
+        total = sighting_rollups.backfill(since, chunk_size=args.chunk_size)
+        print(f"✓ {total} avistamentos agregados")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,203 @@ import base64
 import time
 import argparse
 import sys
+import threading
+import numpy as np
 
 # --- CONFIGURAÇÃO ---
 sio = socketio.Client()
 # Conecte ao seu servidor Flask-SocketIO
 SERVER_ADDR = "http://localhost:5000"
 FPS = 10 # Frames por segundo para enviar ao servidor
+TRANSPORT = "binary" # 'binary' (JPEG puro como anexo Socket.IO) ou 'base64' (formato antigo)
+MAX_IN_FLIGHT = 2 # Frames enviados aguardando confirmação do servidor
+ACK_TIMEOUT = 5.0 # Segundos até considerar perdido um frame sem confirmação
+ADAPTIVE = True # Ajusta qualidade/resolução/FPS conforme a latência dos acks
+TARGET_LATENCY = 0.5 # Latência de ack (envio -> confirmação) considerada saudável
+JPEG_QUALITY = 80 # Qualidade máxima do JPEG
+MIN_JPEG_QUALITY = 40
+MIN_WIDTH = 480 # Piso de resolução: abaixo disso os rostos ficam pequenos demais para o detector
+MIN_FPS = 2
+MODE = "frames" # 'frames' (envia o vídeo) ou 'edge' (detecta e encoda aqui, envia só os encodings)
+PREVIEW_INTERVAL = 2.0 # Modo edge: segundos entre prévias de baixa resolução (0 desativa)
+PREVIEW_WIDTH = 320
+MIN_FACE_SIZE = 80 # Modo edge: menor rosto esperado (px), define a escala da detecção
+
+class FlowControl:
+    """Controle de fluxo por créditos: no máximo N frames aguardando ack do servidor"""
+
+    def __init__(self, max_in_flight, ack_timeout):
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self.in_flight = {}  # sequence -> instante do envio
+        self.lock = threading.Lock()
+        self.acked = 0
+        self.expired = 0
+
+    def acquire(self, sequence):
+        """Reserva um crédito para o frame; False se a janela estiver cheia"""
+        with self.lock:
+            now = time.monotonic()
+            stale = [seq for seq, sent in self.in_flight.items() if now - sent > self.ack_timeout]
+            for seq in stale:
+                del self.in_flight[seq]  # Ack perdido (ex: reconexão): devolve o crédito
+            self.expired += len(stale)
+            if len(self.in_flight) >= self.max_in_flight:
+                return False
+            self.in_flight[sequence] = now
+            return True
+
+    def ack(self, sequence):
+        """Confirma o frame; retorna o tempo entre envio e ack (None se desconhecido)"""
+        with self.lock:
+            sent = self.in_flight.pop(sequence, None)
+            if sent is None:
+                return None
+            self.acked += 1
+            return time.monotonic() - sent
+
+    def cancel(self, sequence):
+        """Devolve o crédito de um frame que foi descartado antes do envio"""
+        with self.lock:
+            self.in_flight.pop(sequence, None)
+
+    def reset(self):
+        with self.lock:
+            self.in_flight.clear()
+
+class AdaptiveBitrate:
+    """Controlador de taxa: ajusta qualidade JPEG, resolução e FPS pela latência dos acks
+
+    Em congestionamento (latência acima do alvo ou frames descartados por falta
+    de crédito) degrada primeiro a qualidade, depois a resolução e por último o
+    FPS; com folga, recupera na ordem inversa. Nunca passa dos pisos.
+    """
+
+    def __init__(self, max_fps, target_latency=TARGET_LATENCY, max_quality=JPEG_QUALITY,
+                 min_quality=MIN_JPEG_QUALITY, min_width=MIN_WIDTH, min_fps=MIN_FPS,
+                 enabled=True, update_interval=1.0, smoothing=0.3):
+        self.max_fps = max_fps
+        self.target_latency = target_latency
+        self.max_quality = max_quality
+        self.min_quality = min(min_quality, max_quality)
+        self.min_width = min_width
+        self.min_fps = min(min_fps, max_fps)
+        self.enabled = enabled
+        self.update_interval = update_interval
+        self.smoothing = smoothing
+        self.quality = max_quality
+        self.scale = 1.0
+        self.fps = max_fps
+        self.latency = None  # Média móvel da latência de ack
+        self.drops = 0  # Descartes por falta de crédito desde o último ajuste
+        self.bytes_sent = 0
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record_ack(self, latency):
+        if latency is None:
+            return
+        with self.lock:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = (1 - self.smoothing) * self.latency + self.smoothing * latency
+
+    def record_drop(self):
+        with self.lock:
+            self.drops += 1
+
+    def record_sent(self, size):
+        with self.lock:
+            self.bytes_sent += size
+
+    def min_scale(self, frame_width):
+        return min(1.0, self.min_width / frame_width)
+
+    def settings(self, frame_width):
+        """(qualidade, escala, fps) a usar no próximo frame"""
+        with self.lock:
+            now = time.monotonic()
+            if self.enabled and now - self.last_update >= self.update_interval:
+                self._adjust(frame_width)
+                self.last_update = now
+                self.drops = 0
+            return self.quality, max(self.scale, self.min_scale(frame_width)), self.fps
+
+    def _adjust(self, frame_width):
+        min_scale = self.min_scale(frame_width)
+        congested = self.drops > 0 or (self.latency is not None and self.latency > self.target_latency)
+        healthy = self.drops == 0 and (self.latency is None or self.latency < self.target_latency / 2)
+
+        if congested:
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 10)
+            elif self.scale > min_scale:
+                self.scale = max(min_scale, self.scale * 0.8)
+            elif self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.75)
+        elif healthy:
+            if self.fps < self.max_fps:
+                self.fps = min(self.max_fps, self.fps / 0.75)
+            elif self.scale < 1.0:
+                self.scale = min(1.0, self.scale / 0.8)
+            elif self.quality < self.max_quality:
+                self.quality = min(self.max_quality, self.quality + 5)
+
+    def report(self, elapsed):
+        with self.lock:
+            kbps = 8 * self.bytes_sent / 1000 / max(elapsed, 1e-6)
+            self.bytes_sent = 0
+            latency = f"{self.latency * 1000:.0f} ms" if self.latency is not None else "-"
+            return (f"qualidade: {self.quality} | escala: {self.scale:.2f} | fps alvo: {self.fps:.1f} | "
+                    f"latência ack: {latency} | {kbps:.0f} kbps")
+
+class EdgeRecognizer:
+    """Modo edge: detecção e encoding de 128 dimensões rodam nesta máquina
+
+    Usa o mesmo pipeline do servidor (detection_backend); o servidor recebe só
+    caixas + encodings e faz o casamento com a galeria.
+    """
+
+    def __init__(self, min_face_size=MIN_FACE_SIZE, preview_interval=PREVIEW_INTERVAL,
+                 preview_width=PREVIEW_WIDTH):
+        # Importado só no modo edge: face_recognition/dlib não são necessários para enviar vídeo
+        import detection_backend
+        self.backend = detection_backend.LocalDetectionBackend()
+        self.scale_factor = detection_backend.detection_scale(min_face_size)
+        self.preview_interval = preview_interval
+        self.preview_width = preview_width
+        self.last_preview = 0.0
+
+    def detections(self, frame, sequence, capture_time):
+        """Monta o payload do evento 'detections' (e a prévia, quando for a hora)"""
+        face_locations, face_encodings = self.backend.detect_and_encode(frame, self.scale_factor)
+        encodings = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+        payload = {
+            'timestamp': capture_time,
+            'sequence': sequence,
+            'locations': [list(location) for location in face_locations],
+            'frame_width': frame.shape[1],
+            'frame_height': frame.shape[0],
+        }
+        if TRANSPORT == 'binary':
+            payload['encodings'] = encodings.tobytes()  # float32, 512 bytes por rosto
+        else:
+            payload['encodings'] = encodings.tolist()
+
+        now = time.monotonic()
+        if self.preview_interval > 0 and now - self.last_preview >= self.preview_interval:
+            self.last_preview = now
+            scale = min(1.0, self.preview_width / frame.shape[1])
+            small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            _, buffer = cv2.imencode('.jpg', small, [int(cv2.IMWRITE_JPEG_QUALITY), 60])
+            if TRANSPORT == 'binary':
+                payload['preview'] = buffer.tobytes()
+            else:
+                payload['preview'] = f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+        return payload
+
+flow_control = None
 
 @sio.event
 def connect():
@@ -18,13 +209,175 @@ def connect():
 @sio.event
 def disconnect():
     print('Desconectado do servidor.')
+    if flow_control is not None:
+        flow_control.reset()  # Acks pendentes não vão mais chegar
 
 @sio.event
 def connect_error(data):
     print(f'Erro na conexão: {data}')
 
+class LatestSlot:
+    """Slot "último vence" entre dois estágios do pipeline"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.closed = False
+
+    def put(self, item):
+        """Guarda o item e devolve o anterior que não chegou a ser consumido"""
+        with self.condition:
+            replaced, self.item = self.item, item
+            self.condition.notify()
+            return replaced
+
+    def take(self, timeout=0.5):
+        """Retira o item mais recente (None se vazio após o timeout ou fechado)"""
+        with self.condition:
+            if self.item is None and not self.closed:
+                self.condition.wait(timeout)
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class StageRate:
+    """Conta os itens processados por um estágio para reportar a taxa atingida"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.last_count = 0
+        self.last_time = time.monotonic()
+
+    def tick(self):
+        self.count += 1
+
+    def rate(self):
+        now = time.monotonic()
+        value = (self.count - self.last_count) / max(now - self.last_time, 1e-6)
+        self.last_count, self.last_time = self.count, now
+        return value
+
+def grab_frames(cap, raw_slot, stop_event, rates):
+    """Estágio de captura: lê sem parar para o buffer da câmera nunca ficar velho"""
+    sequence = 0
+    while not stop_event.is_set():
+        success, frame = cap.read()
+        if not success:
+            print("Fim do stream ou erro na captura.")
+            stop_event.set()
+            break
+        raw_slot.put((sequence, time.time(), frame))
+        sequence += 1
+        rates['captura'].tick()
+    raw_slot.close()
+
+def encode_frames(raw_slot, encoded_slot, stop_event, rates, counters, bitrate, edge=None):
+    """Estágio de codificação: pega o frame mais novo no ritmo do FPS e gera o JPEG
+
+    No modo edge (edge != None) gera as detecções + encodings em vez do JPEG.
+    """
+    next_time = time.monotonic()
+    fps = FPS
+    while not stop_event.is_set():
+        # Controla o FPS (ajustado pelo controlador de taxa)
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_time = max(next_time + 1/fps, time.monotonic())
+
+        item = raw_slot.take()
+        if item is None:
+            continue
+        sequence, capture_time, frame = item
+        quality, scale, fps = bitrate.settings(frame.shape[1])
+
+        # Sem crédito (servidor atrasado): descarta este frame em vez de
+        # enfileirar; o próximo frame capturado, mais novo, ocupa o lugar dele
+        if not flow_control.acquire(sequence):
+            counters['dropped'] += 1
+            bitrate.record_drop()
+            continue
+
+        try:
+            if edge is not None:
+                # Resolução cheia: a escala da detecção já é escolhida pelo tamanho de rosto
+                buffer, detections = None, edge.detections(frame, sequence, capture_time)
+            else:
+                if scale < 1.0:
+                    frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+                detections = None
+        except Exception as e:
+            # Um frame ruim não derruba o estágio: devolve o crédito e segue para o próximo
+            flow_control.cancel(sequence)
+            print(f"Erro ao codificar o frame {sequence}: {e}")
+            continue
+        rates['codificação'].tick()
+
+        replaced = encoded_slot.put((sequence, capture_time, buffer, detections))
+        if replaced is not None:
+            # O envio não acompanhou: o JPEG mais velho é descartado e devolve o crédito
+            flow_control.cancel(replaced[0])
+            counters['dropped'] += 1
+    encoded_slot.close()
+
+def send_frames(camera_id, encoded_slot, stop_event, rates, bitrate):
+    """Estágio de envio: emite o JPEG mais recente para o servidor"""
+    while not stop_event.is_set():
+        item = encoded_slot.take()
+        if item is None:
+            continue
+        sequence, capture_time, buffer, detections = item
+
+        # O servidor confirma (ack) ao terminar o processamento e devolve o crédito;
+        # o tempo até o ack alimenta o controlador de taxa
+        on_ack = lambda *args, seq=sequence: bitrate.record_ack(flow_control.ack(seq))
+        try:
+            if detections is not None:
+                # Modo edge: só caixas + encodings (e a prévia ocasional)
+                detections['camera_id'] = camera_id
+                sio.emit('detections', detections, callback=on_ack)
+                size = len(detections['locations']) * (16 + 512) + len(detections.get('preview') or b'')
+            elif TRANSPORT == 'binary':
+                # Bytes do JPEG vão como anexo binário, com um cabeçalho pequeno de metadados
+                sio.emit('stream', {
+                    'image': buffer.tobytes(),
+                    'camera_id': camera_id,
+                    'timestamp': capture_time,
+                    'sequence': sequence
+                }, callback=on_ack)
+                size = len(buffer)
+            else:
+                # Formato antigo: data URL em Base64
+                image_data = base64.b64encode(buffer).decode('utf-8')
+                sio.emit('stream', {
+                    'image': f"data:image/jpeg;base64,{image_data}",
+                    'camera_id': camera_id,
+                    'sequence': sequence
+                }, callback=on_ack)
+                size = len(buffer)
+        except Exception as e:
+            # Ex.: emit durante uma desconexão/reconexão; o ack não virá, então devolve o crédito
+            flow_control.cancel(sequence)
+            print(f"Erro no envio do frame {sequence}: {e}")
+            continue
+        bitrate.record_sent(size)
+        rates['envio'].tick()
+
 def stream_video(camera_id, video_source):
-    """Captura vídeo e envia frames para o servidor."""
+    """Captura vídeo e envia frames para o servidor.
+
+    Pipeline de três threads (captura -> codificação -> envio) ligadas por
+    slots "último vence": um estágio lento descarta frames em vez de atrasar
+    os outros.
+    """
+    global flow_control
+    flow_control = FlowControl(MAX_IN_FLIGHT, ACK_TIMEOUT)
     try:
         # Tenta converter para int (webcam) ou usar como string (URL)
         try:
@@ -39,36 +392,41 @@ def stream_video(camera_id, video_source):
 
         print(f"Iniciando stream da câmera {camera_id} (fonte: {video_source})")
         
-        # Inicia a câmera no servidor
-        sio.emit('start_camera', {'camera_id': camera_id})
+        # Inicia a câmera no servidor; no modo edge quem detecta é este cliente,
+        # então o servidor não deve abrir a fonte nem rodar a detecção central
+        sio.emit('start_camera', {'camera_id': camera_id, 'client_driven': MODE == 'edge'})
+        
+        stop_event = threading.Event()
+        raw_slot = LatestSlot()
+        encoded_slot = LatestSlot()
+        rates = {name: StageRate(name) for name in ('captura', 'codificação', 'envio')}
+        counters = {'dropped': 0}
+        bitrate = AdaptiveBitrate(FPS, target_latency=TARGET_LATENCY, min_width=MIN_WIDTH, enabled=ADAPTIVE)
+        edge = EdgeRecognizer(MIN_FACE_SIZE, PREVIEW_INTERVAL, PREVIEW_WIDTH) if MODE == 'edge' else None
+        threads = [
+            threading.Thread(target=grab_frames, args=(cap, raw_slot, stop_event, rates), daemon=True),
+            threading.Thread(target=encode_frames,
+                             args=(raw_slot, encoded_slot, stop_event, rates, counters, bitrate, edge),
+                             daemon=True),
+            threading.Thread(target=send_frames, args=(camera_id, encoded_slot, stop_event, rates, bitrate),
+                             daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
         
-        frame_count = 0
         try:
-            while True:
-                success, frame = cap.read()
-                if not success:
-                    print("Fim do stream ou erro na captura.")
-                    break
-
-                # Codifica a imagem para JPG e depois para Base64
-                _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-                image_data = base64.b64encode(buffer).decode('utf-8')
-
-                # Envia o frame para o servidor com o ID da câmera
-                sio.emit('stream', {
-                    'image': f"data:image/jpeg;base64,{image_data}",
-                    'camera_id': camera_id
-                })
-
-                frame_count += 1
-                if frame_count % (FPS * 10) == 0:  # Log a cada 10 segundos
-                    print(f"Frames enviados: {frame_count}")
-
-                # Controla o FPS
-                time.sleep(1/FPS)
+            # Log a cada 10 segundos com a taxa atingida por estágio
+            while not stop_event.wait(10):
+                report = " | ".join(f"{name}: {rate.rate():.1f} fps" for name, rate in rates.items())
+                print(f"{report} | descartados: {counters['dropped']} | "
+                      f"em trânsito: {len(flow_control.in_flight)}")
+                print(bitrate.report(10))
         except KeyboardInterrupt:
             print("\nParando stream...")
         finally:
+            stop_event.set()
+            for thread in threads:
+                thread.join(timeout=2)
             # Para a câmera no servidor
             sio.emit('stop_camera', {'camera_id': camera_id})
             cap.release()
@@ -77,6 +435,9 @@ def stream_video(camera_id, video_source):
         print(f"Erro no stream: {e}")
 
 def main():
+    global SERVER_ADDR, FPS, TRANSPORT, MAX_IN_FLIGHT, ADAPTIVE, TARGET_LATENCY, MIN_WIDTH
+    global MODE, PREVIEW_INTERVAL, MIN_FACE_SIZE
+    
     parser = argparse.ArgumentParser(description='Cliente de câmera para sistema de reconhecimento facial')
     parser.add_argument('--camera-id', type=int, required=True, 
                        help='ID da câmera no banco de dados')
@@ -86,17 +447,45 @@ def main():
                        help=f'Endereço do servidor (padrão: {SERVER_ADDR})')
     parser.add_argument('--fps', type=int, default=FPS,
                        help=f'Frames por segundo (padrão: {FPS})')
+    parser.add_argument('--transport', choices=['binary', 'base64'], default=TRANSPORT,
+                       help=f'Formato de envio dos frames (padrão: {TRANSPORT})')
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT,
+                       help=f'Frames aguardando confirmação do servidor (padrão: {MAX_IN_FLIGHT})')
+    parser.add_argument('--no-adaptive', action='store_true',
+                       help='Desativa o ajuste automático de qualidade/resolução/FPS')
+    parser.add_argument('--target-latency', type=float, default=TARGET_LATENCY,
+                       help=f'Latência de ack considerada saudável, em segundos (padrão: {TARGET_LATENCY})')
+    parser.add_argument('--min-width', type=int, default=MIN_WIDTH,
+                       help=f'Largura mínima do frame enviado (padrão: {MIN_WIDTH}); '
+                            'abaixo disso os rostos ficam pequenos para o detector')
+    parser.add_argument('--mode', choices=['frames', 'edge'], default=MODE,
+                       help=f'frames = envia o vídeo; edge = detecta/encoda localmente e envia só os encodings (padrão: {MODE})')
+    parser.add_argument('--preview-interval', type=float, default=PREVIEW_INTERVAL,
+                       help=f'Modo edge: segundos entre prévias de baixa resolução, 0 desativa (padrão: {PREVIEW_INTERVAL})')
+    parser.add_argument('--min-face-size', type=int, default=MIN_FACE_SIZE,
+                       help=f'Modo edge: menor rosto esperado em pixels (padrão: {MIN_FACE_SIZE})')
     
     args = parser.parse_args()
     
-    global SERVER_ADDR, FPS
     SERVER_ADDR = args.server
     FPS = args.fps
+    TRANSPORT = args.transport
+    MAX_IN_FLIGHT = max(1, args.max_in_flight)
+    ADAPTIVE = not args.no_adaptive
+    TARGET_LATENCY = args.target_latency
+    MIN_WIDTH = args.min_width
+    MODE = args.mode
+    PREVIEW_INTERVAL = args.preview_interval
+    MIN_FACE_SIZE = args.min_face_size
     
     print(f"Conectando ao servidor: {SERVER_ADDR}")
     print(f"Câmera ID: {args.camera_id}")
     print(f"Fonte: {args.source}")
     print(f"FPS: {FPS}")
+    print(f"Transporte: {TRANSPORT}")
+    print(f"Modo: {MODE}")
+    print(f"Frames em trânsito (máx.): {MAX_IN_FLIGHT}")
+    print(f"Taxa adaptativa: {'sim' if ADAPTIVE else 'não'} (piso: {MIN_WIDTH}px, {MIN_FPS} fps, qualidade {MIN_JPEG_QUALITY})")
     
     try:
         sio.connect(SERVER_ADDR)
@@ -8,12 +8,136 @@ import sys
 import time
 import json
 import os
-from threading import Thread
+import re
+from collections import deque
+from threading import Thread, Lock
+
+try:
+    import psutil  # Opcional: CPU/RSS e afinidade de CPU em qualquer sistema
+except ImportError:
+    psutil = None
+
+SEND_RATE_PATTERN = re.compile(r'envio: ([0-9.]+) fps')
+
+def process_usage(pid):
+    """(segundos de CPU, RSS em bytes) de um processo; None se indisponível"""
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            times = proc.cpu_times()
+            return times.user + times.system, proc.memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        # Sem psutil: lê direto do /proc (Linux)
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+        rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu_seconds, rss
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def pin_process(pid, cpu):
+    """Fixa o processo em uma CPU; retorna False se o sistema não suportar"""
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(pid, {cpu})
+            return True
+        if psutil is not None:
+            psutil.Process(pid).cpu_affinity([cpu])
+            return True
+    except (OSError, AttributeError, ValueError) as e:
+        print(f"Não foi possível fixar o PID {pid} na CPU {cpu}: {e}")
+    return False
+
+class ClientProcess:
+    """Um cliente supervisionado: processo, saída drenada, reinícios e estatísticas"""
+
+    def __init__(self, key, cmd, cpu=None):
+        self.key = key
+        self.cmd = cmd
+        self.cpu = cpu  # CPU fixa (None = livre)
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0  # Reinícios seguidos (zera quando o processo fica estável)
+        self.next_restart = None
+        self.output = deque(maxlen=50)  # Últimas linhas da saída
+        self.send_rates = {}  # Fonte da linha de log -> frames enviados/s
+        self.lock = Lock()
+        self.last_cpu = None  # (instante, segundos de CPU) da última amostra
+        self.cpu_percent = 0.0
+        self.rss = 0
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        env = dict(os.environ, PYTHONUNBUFFERED='1')  # Logs linha a linha para o supervisor
+        self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        env=env, text=True, errors='replace', bufsize=1)
+        self.started_at = time.monotonic()
+        self.next_restart = None
+        self.last_cpu = None
+        if self.cpu is not None:
+            pin_process(self.process.pid, self.cpu)
+        # Drena a saída sem parar: um pipe cheio travaria o cliente
+        Thread(target=self._drain, args=(self.process,), daemon=True).start()
+
+    def _drain(self, process):
+        for line in process.stdout:
+            line = line.rstrip()
+            match = SEND_RATE_PATTERN.search(line)
+            with self.lock:
+                self.output.append(line)
+                if match:
+                    # No cliente multi-câmera cada câmera tem sua linha "[câmera N] ..."
+                    source = line.split(']')[0] if line.startswith('[') else ''
+                    self.send_rates[source] = float(match.group(1))
+        process.stdout.close()
+
+    def sample(self):
+        """Atualiza CPU (%) e RSS a partir do sistema operacional"""
+        if not self.running():
+            return
+        usage = process_usage(self.process.pid)
+        if usage is None:
+            return
+        cpu_seconds, self.rss = usage
+        now = time.monotonic()
+        if self.last_cpu is not None:
+            elapsed = now - self.last_cpu[0]
+            if elapsed > 0:
+                self.cpu_percent = 100.0 * (cpu_seconds - self.last_cpu[1]) / elapsed
+        self.last_cpu = (now, cpu_seconds)
+
+    def frames_sent_rate(self):
+        with self.lock:
+            return sum(self.send_rates.values())
+
+    def stop(self):
+        if self.running():
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
 
 class CameraManager:
-    def __init__(self):
-        self.processes = {}
+    def __init__(self, pin_cpus=False, base_backoff=1.0, max_backoff=60.0, stable_after=60.0):
+        self.processes = {}  # Chave (camera_id ou 'multi') -> ClientProcess
         self.config_file = "cameras_config.json"
+        self.pin_cpus = pin_cpus
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after  # Segundos rodando para o contador de reinícios zerar
+        self.running = False
     
     def load_config(self):
         """Carrega configuração de câmeras do arquivo JSON"""
@@ -27,6 +151,22 @@ class CameraManager:
         with open(self.config_file, 'w') as f:
             json.dump(config, f, indent=2)
     
+    def _next_cpu(self):
+        """CPU para o próximo cliente (rodízio entre as CPUs disponíveis)"""
+        if not self.pin_cpus:
+            return None
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+        return cpus[len(self.processes) % len(cpus)]
+    
+    def _launch(self, key, cmd):
+        client = ClientProcess(key, cmd, cpu=self._next_cpu())
+        client.start()
+        self.processes[key] = client
+        return client
+    
     def start_camera(self, camera_id, source, server="http://localhost:5000"):
         """Inicia uma câmera específica"""
         if camera_id in self.processes:
@@ -41,24 +181,40 @@ class CameraManager:
         ]
         
         try:
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.processes[camera_id] = process
-            print(f"✓ Câmera {camera_id} iniciada (PID: {process.pid})")
+            client = self._launch(camera_id, cmd)
+            pinned = f", CPU {client.cpu}" if client.cpu is not None else ""
+            print(f"✓ Câmera {camera_id} iniciada (PID: {client.pid}{pinned})")
             return True
         except Exception as e:
             print(f"❌ Erro ao iniciar câmera {camera_id}: {e}")
             return False
     
+    def start_multi(self, cameras, server="http://localhost:5000"):
+        """Inicia várias câmeras em um único processo (multi_camera_client.py)"""
+        if 'multi' in self.processes:
+            print("O cliente multi-câmera já está rodando!")
+            return False
+        
+        cmd = [sys.executable, "multi_camera_client.py", "--server", server]
+        for camera in cameras:
+            cmd += ["--camera", f"{camera['id']}={camera['source']}"]
+        
+        try:
+            client = self._launch('multi', cmd)
+            print(f"✓ {len(cameras)} câmeras iniciadas em um único processo (PID: {client.pid})")
+            return True
+        except Exception as e:
+            print(f"❌ Erro ao iniciar o cliente multi-câmera: {e}")
+            return False
+    
     def stop_camera(self, camera_id):
         """Para uma câmera específica"""
         if camera_id not in self.processes:
             print(f"Câmera {camera_id} não está rodando!")
             return False
         
-        process = self.processes[camera_id]
-        process.terminate()
-        process.wait()
-        del self.processes[camera_id]
+        client = self.processes.pop(camera_id)
+        client.stop()
         print(f"✓ Câmera {camera_id} parada")
         return True
     
@@ -67,6 +223,46 @@ class CameraManager:
         for camera_id in list(self.processes.keys()):
             self.stop_camera(camera_id)
     
+    def check_clients(self):
+        """Um passo da supervisão: detecta clientes que morreram e reinicia com backoff exponencial"""
+        now = time.monotonic()
+        for key, client in list(self.processes.items()):
+            if client.running():
+                if client.restarts and now - client.started_at >= self.stable_after:
+                    client.restarts = 0  # Rodou estável: a próxima falha volta ao backoff mínimo
+                client.sample()
+                continue
+            
+            if client.next_restart is None:
+                delay = min(self.max_backoff, self.base_backoff * (2 ** client.restarts))
+                client.next_restart = now + delay
+                with client.lock:
+                    last_line = client.output[-1] if client.output else ''
+                print(f"❌ Cliente {key} terminou (código {client.process.returncode}); "
+                      f"reiniciando em {delay:.1f}s. Última saída: {last_line}")
+            elif now >= client.next_restart:
+                client.restarts += 1
+                try:
+                    client.start()
+                    print(f"✓ Cliente {key} reiniciado (PID: {client.pid}, tentativa {client.restarts})")
+                except Exception as e:
+                    client.next_restart = None
+                    print(f"❌ Erro ao reiniciar cliente {key}: {e}")
+    
+    def supervise(self, interval=1.0, report_every=10.0):
+        """Laço de supervisão em primeiro plano (até Ctrl+C)"""
+        self.running = True
+        last_report = time.monotonic()
+        try:
+            while self.running and self.processes:
+                self.check_clients()
+                if time.monotonic() - last_report >= report_every:
+                    self.list_cameras()
+                    last_report = time.monotonic()
+                time.sleep(interval)
+        finally:
+            self.running = False
+    
     def list_cameras(self):
         """Lista câmeras ativas"""
         if not self.processes:
@@ -74,17 +270,23 @@ class CameraManager:
             return
         
         print("Câmeras ativas:")
-        for camera_id, process in self.processes.items():
-            status = "Rodando" if process.poll() is None else "Parada"
-            print(f"  - Câmera {camera_id}: {status} (PID: {process.pid})")
+        for camera_id, client in self.processes.items():
+            status = "Rodando" if client.running() else "Parada"
+            print(f"  - Câmera {camera_id}: {status} (PID: {client.pid}) | "
+                  f"CPU: {client.cpu_percent:.0f}% | RSS: {client.rss / (1024 * 1024):.0f} MB | "
+                  f"envio: {client.frames_sent_rate():.1f} fps | reinícios: {client.restarts}")
     
-    def start_from_config(self):
+    def start_from_config(self, single_process=False):
         """Inicia todas as câmeras da configuração"""
         config = self.load_config()
         if not config.get('cameras'):
             print("Nenhuma câmera configurada")
             return
         
+        if single_process:
+            self.start_multi(config['cameras'], config.get('server', 'http://localhost:5000'))
+            return
+        
         for camera in config['cameras']:
             self.start_camera(
                 camera['id'], 
@@ -93,7 +295,11 @@ class CameraManager:
             )
 
 def main():
-    manager = CameraManager()
+    # --pin-cpus pode aparecer em qualquer posição
+    pin_cpus = '--pin-cpus' in sys.argv
+    if pin_cpus:
+        sys.argv.remove('--pin-cpus')
+    manager = CameraManager(pin_cpus=pin_cpus)
     
     if len(sys.argv) < 2:
         print("Sistema de Gerenciamento de Câmeras")
@@ -102,10 +308,14 @@ def main():
         print("  python camera_manager.py start <camera_id> <source>  # Inicia uma câmera")
         print("  python camera_manager.py stop <camera_id>            # Para uma câmera")
         print("  python camera_manager.py start-all                   # Inicia todas (config)")
+        print("  python camera_manager.py start-all-multi             # Inicia todas em um único processo")
         print("  python camera_manager.py stop-all                    # Para todas")
         print("  python camera_manager.py list                        # Lista câmeras ativas")
         print("  python camera_manager.py config                      # Configura câmeras")
         print()
+        print("Os comandos start* ficam supervisionando os clientes (reinício automático e")
+        print("estatísticas a cada 10s) até Ctrl+C. Use --pin-cpus para fixar cada cliente em uma CPU.")
+        print()
         print("Exemplos:")
         print("  python camera_manager.py start 1 0                   # Webcam padrão")
         print("  python camera_manager.py start 2 1                   # Segunda webcam")
@@ -119,6 +329,7 @@ def main():
             camera_id = int(sys.argv[2])
             source = sys.argv[3]
             manager.start_camera(camera_id, source)
+            manager.supervise()
         
         elif command == "stop" and len(sys.argv) >= 3:
             camera_id = int(sys.argv[2])
@@ -126,6 +337,11 @@ def main():
         
         elif command == "start-all":
             manager.start_from_config()
+            manager.supervise()
+        
+        elif command == "start-all-multi":
+            manager.start_from_config(single_process=True)
+            manager.supervise()
         
         elif command == "stop-all":
             manager.stop_all()
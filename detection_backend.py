@@ -0,0 +1,145 @@
+"""
+Backends de detecção + encoding de rostos
+- local: roda no próprio processo (threads do servidor, limitado pelo GIL)
+- process: pool de processos; os modelos do dlib são carregados antes do fork
+  para que as páginas sejam compartilhadas (copy-on-write) entre os workers
+
+Pipeline em dois estágios: a detecção (HOG) roda em um frame bem reduzido,
+com escala escolhida pelo tamanho de rosto esperado em cada câmera, e o
+encoding roda em recortes em resolução original ao redor de cada rosto.
+"""
+
+import atexit
+import multiprocessing
+import os
+
+import cv2
+import face_recognition  # Carrega os modelos do dlib na importação
+
+HOG_WINDOW = 80  # Lado (px) da janela do detector HOG do dlib sem upsample
+DEFAULT_MIN_FACE_SIZE = 80  # Menor rosto esperado (px no frame original)
+CROP_MARGIN = 0.25  # Margem ao redor do rosto no recorte usado para o encoding
+
+
+def detection_scale(min_face_size=None):
+    """Escala de detecção para que o menor rosto esperado ainda caiba na janela HOG"""
+    min_face_size = min_face_size or DEFAULT_MIN_FACE_SIZE
+    return min(1.0, max(0.1, HOG_WINDOW / float(min_face_size)))
+
+
+def prepare_frame(frame, scale_factor):
+    """Reduz o frame e converte para RGB (feito no processo principal, libera o GIL)"""
+    if scale_factor != 1.0:
+        frame = cv2.resize(frame, (0, 0), fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def crop_faces(frame, face_locations, margin=CROP_MARGIN):
+    """Recorta (em resolução original) cada rosto com margem; retorna (recorte RGB, localização no recorte)"""
+    height, width = frame.shape[:2]
+    crops = []
+    for top, right, bottom, left in face_locations:
+        pad_y = int((bottom - top) * margin)
+        pad_x = int((right - left) * margin)
+        y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+        x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+        crop = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+        crops.append((crop, (max(0, top - y0), min(x1, right) - x0, min(y1, bottom) - y0, max(0, left - x0))))
+    return crops
+
+
+def locate(rgb_small_frame):
+    """Encontra os rostos (HOG, sem upsample) no frame reduzido"""
+    return face_recognition.face_locations(rgb_small_frame, number_of_times_to_upsample=0, model="hog")
+
+
+def encode_crops(crops):
+    """Calcula os encodings de 128 dimensões a partir dos recortes em resolução original"""
+    encodings = []
+    for crop, location in crops:
+        encodings.extend(face_recognition.face_encodings(crop, [location]))
+    return encodings
+
+
+def scale_locations(face_locations, scale_factor):
+    """Escala localizações de volta para tamanho original"""
+    return [
+        (int(top / scale_factor), int(right / scale_factor),
+         int(bottom / scale_factor), int(left / scale_factor))
+        for top, right, bottom, left in face_locations
+    ]
+
+
+class LocalDetectionBackend:
+    name = 'local'
+
+    def detect(self, frame, scale_factor=1.0):
+        return scale_locations(locate(prepare_frame(frame, scale_factor)), scale_factor)
+
+    def encode(self, frame, face_locations):
+        if not face_locations:
+            return []
+        return encode_crops(crop_faces(frame, face_locations))
+
+    def detect_and_encode(self, frame, scale_factor=1.0):
+        face_locations = self.detect(frame, scale_factor)
+        return face_locations, self.encode(frame, face_locations)
+
+    def shutdown(self):
+        pass
+
+
+class ProcessDetectionBackend:
+    name = 'process'
+
+    def __init__(self, processes=None):
+        self.processes = processes or max(1, (os.cpu_count() or 2) - 1)
+        # fork herda os modelos já carregados; no Windows só há spawn (cada worker recarrega)
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.pool = context.Pool(self.processes)
+        print(f"Backend de detecção em processos iniciado ({self.processes} workers, {context.get_start_method()})")
+
+    def detect(self, frame, scale_factor=1.0):
+        # Só o frame reduzido atravessa o pipe; a thread chamadora espera sem segurar o GIL
+        face_locations = self.pool.apply(locate, (prepare_frame(frame, scale_factor),))
+        return scale_locations(face_locations, scale_factor)
+
+    def encode(self, frame, face_locations):
+        if not face_locations:
+            return []
+        # Só os recortes dos rostos atravessam o pipe
+        return self.pool.apply(encode_crops, (crop_faces(frame, face_locations),))
+
+    def detect_and_encode(self, frame, scale_factor=1.0):
+        face_locations = self.detect(frame, scale_factor)
+        return face_locations, self.encode(frame, face_locations)
+
+    def shutdown(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+_backend = None
+
+
+def configure_backend(kind='local', processes=None):
+    """Cria o backend global; 'process' deve ser configurado antes de iniciar threads"""
+    global _backend
+    if _backend is not None:
+        _backend.shutdown()
+
+    if kind == 'process':
+        _backend = ProcessDetectionBackend(processes)
+        atexit.register(_backend.shutdown)
+    else:
+        _backend = LocalDetectionBackend()
+    return _backend
+
+
+def get_backend():
+    """Backend atual (local por padrão)"""
+    global _backend
+    if _backend is None:
+        _backend = LocalDetectionBackend()
+    return _backend
@@ -0,0 +1,117 @@
+"""
+Escalonador adaptativo dos passes de detecção por câmera
+Substitui o sleep fixo: câmeras com rostos recebem mais passes, câmeras
+sem rostos vão espaçando, e quando a soma do custo medido (tempo de
+detecção no batcher / intervalo) passa do orçamento global de CPU os
+intervalos são esticados por prioridade, em vez de todas as câmeras
+atrasarem juntas. Passes pulados pelo filtro de movimento não espaçam: a
+checagem de movimento é barata e continua no ritmo mínimo, para não perder
+quem entra em uma cena parada.
+"""
+
+import os
+import threading
+import time
+
+
+class CameraSchedule:
+    def __init__(self, interval):
+        self.interval = interval  # Intervalo desejado pela atividade da câmera
+        self.latency = 0.0  # Média móvel da latência de um passe de detecção
+        self.faces = 0.0  # Média móvel de rostos por passe
+        self.last_start = 0.0
+        self.skipped = False  # Último passe foi pulado pelo filtro de movimento
+
+
+class DetectionScheduler:
+    def __init__(self, min_interval=0.1, max_interval=2.0, cpu_budget=None, backoff=1.5, smoothing=0.3,
+                 stale_after=30.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # Orçamento em segundos de CPU por segundo (padrão: 80% dos núcleos)
+        self.cpu_budget = cpu_budget or 0.8 * (os.cpu_count() or 1)
+        self.backoff = backoff  # Fator de espaçamento por passe sem rostos
+        self.smoothing = smoothing
+        self.stale_after = stale_after  # Câmeras sem passe há mais que isso saem do cálculo da demanda
+        self.cameras = {}
+        self.lock = threading.Lock()
+
+    def _schedule(self, camera_id):
+        schedule = self.cameras.get(camera_id)
+        if schedule is None:
+            schedule = self.cameras[camera_id] = CameraSchedule(self.min_interval)
+        return schedule
+
+    def unregister(self, camera_id):
+        with self.lock:
+            self.cameras.pop(camera_id, None)
+
+    def start(self, camera_id):
+        """Marca o início de um passe de detecção"""
+        with self.lock:
+            self._schedule(camera_id).last_start = time.monotonic()
+
+    def record(self, camera_id, latency, face_count):
+        """Registra o resultado de um passe e ajusta o intervalo desejado da câmera"""
+        with self.lock:
+            schedule = self._schedule(camera_id)
+            alpha = self.smoothing
+            schedule.latency = (1 - alpha) * schedule.latency + alpha * latency
+            schedule.faces = (1 - alpha) * schedule.faces + alpha * face_count
+            schedule.skipped = False
+
+            if face_count > 0:
+                schedule.interval = self.min_interval  # Câmera ativa: volta ao ritmo máximo
+            else:
+                schedule.interval = min(self.max_interval, schedule.interval * self.backoff)
+
+    def record_skip(self, camera_id):
+        """Passe pulado (filtro de movimento): sem custo de CPU e sem espaçar a próxima checagem"""
+        with self.lock:
+            schedule = self._schedule(camera_id)
+            schedule.faces = (1 - self.smoothing) * schedule.faces
+            schedule.skipped = True
+
+    def _live_schedules(self, current_id):
+        """Câmeras com passe recente; as paradas sem unregister são descartadas (chamar com o lock)"""
+        cutoff = time.monotonic() - self.stale_after
+        for camera_id in [c for c, s in self.cameras.items() if c != current_id and s.last_start and s.last_start < cutoff]:
+            del self.cameras[camera_id]
+        return list(self.cameras.values())
+
+    def _priority(self, schedule):
+        return 1.0 + min(schedule.faces, 3.0)
+
+    def next_interval(self, camera_id):
+        """Intervalo (início a início) até o próximo passe desta câmera"""
+        with self.lock:
+            schedule = self._schedule(camera_id)
+            if schedule.skipped:
+                return self.min_interval  # Só a checagem de movimento, fora do orçamento de detecção
+            live = self._live_schedules(camera_id)
+            demand = sum(s.latency / s.interval for s in live)
+            if demand <= self.cpu_budget:
+                return schedule.interval
+
+            # Sobrecarga: divide o orçamento proporcionalmente à prioridade (rostos recentes)
+            total_priority = sum(self._priority(s) for s in live) or self._priority(schedule)
+            share = self.cpu_budget * self._priority(schedule) / total_priority
+            return max(schedule.interval, schedule.latency / share)
+
+    def delay(self, camera_id):
+        """Quanto dormir agora para respeitar o intervalo desde o início do último passe"""
+        interval = self.next_interval(camera_id)
+        with self.lock:
+            elapsed = time.monotonic() - self._schedule(camera_id).last_start
+        return max(0.0, interval - elapsed)
+
+    def due(self, camera_id):
+        """Indica se já é hora de um novo passe (para streams ditados pelo cliente)"""
+        return self.delay(camera_id) <= 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                camera_id: {'interval': s.interval, 'latency': s.latency, 'faces': s.faces}
+                for camera_id, s in self.cameras.items()
+            }
@@ -0,0 +1,409 @@
+"""
+Galeria de rostos conhecidos em memória
+Mantém os encodings de um usuário em uma matriz float32 contígua e pré-alocada,
+com normas pré-calculadas e índice id -> linha para inserções e remoções O(1).
+Opcionalmente usa um índice IVF (k-means) para busca aproximada em galerias grandes;
+o (re)treino roda em uma thread à parte, fora do caminho das detecções.
+"""
+
+import threading
+
+import numpy as np
+
+ASSIGN_CHUNK = 4096  # Vetores por bloco na atribuição aos centróides (limita a matriz N x nlist)
+
+
+def _squared_distances(points, sq_norms, query):
+    """|p - q|² para cada linha de points, usando normas pré-calculadas"""
+    sq_distances = sq_norms + np.dot(query, query) - 2.0 * (points @ query)
+    np.maximum(sq_distances, 0.0, out=sq_distances)
+    return sq_distances
+
+
+class IVFIndex:
+    """Índice invertido sobre partições k-means (IVF-Flat) em NumPy puro
+
+    A busca compara a consulta apenas com os centróides, visita as `nprobe`
+    partições mais próximas e devolve os rostos delas para re-ranqueamento
+    exato. `nprobe` maior aumenta o recall e o custo da busca.
+    """
+
+    def __init__(self, nlist=0, nprobe=8, iterations=10, seed=0):
+        self.requested_nlist = nlist  # 0 = automático (~4 * sqrt(N))
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None
+        self.centroid_sq_norms = None
+        self.lists = []  # ids dos rostos de cada partição
+        self.positions = {}  # face_id -> (partição, posição na lista)
+        self.trained_size = 0
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def reset(self):
+        self.centroids = None
+        self.centroid_sq_norms = None
+        self.lists = []
+        self.positions = {}
+        self.trained_size = 0
+
+    def empty_copy(self):
+        """Índice novo, sem treino, com os mesmos parâmetros (para re-treinar em paralelo)"""
+        return IVFIndex(nlist=self.requested_nlist, nprobe=self.nprobe,
+                        iterations=self.iterations, seed=self.seed)
+
+    @staticmethod
+    def _assign(vectors, centroids, sq_norms):
+        """Centróide mais próximo de cada vetor, em blocos para não montar a matriz N x nlist inteira"""
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), ASSIGN_CHUNK):
+            chunk = vectors[start:start + ASSIGN_CHUNK]
+            assignment[start:start + ASSIGN_CHUNK] = np.argmin(sq_norms[None, :] - 2.0 * (chunk @ centroids.T), axis=1)
+        return assignment
+
+    def _nearest_centroids(self, vectors, count):
+        scores = self.centroid_sq_norms[None, :] - 2.0 * (vectors @ self.centroids.T)
+        if count >= scores.shape[1]:
+            return np.argsort(scores, axis=1)
+        nearest = np.argpartition(scores, count - 1, axis=1)[:, :count]
+        order = np.take_along_axis(scores, nearest, axis=1).argsort(axis=1)
+        return np.take_along_axis(nearest, order, axis=1)
+
+    def train(self, vectors, face_ids):
+        """Executa k-means sobre uma amostra e distribui todos os rostos nas partições"""
+        count = len(vectors)
+        nlist = self.requested_nlist or int(4 * np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+
+        # Treina sobre uma amostra limitada para manter o custo previsível
+        sample_size = min(count, 64 * nlist)
+        sample = vectors[self.rng.choice(count, sample_size, replace=False)]
+        centroids = sample[self.rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+            assignment = self._assign(sample, centroids, sq_norms)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Partições vazias recebem pontos aleatórios da amostra
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = sample[self.rng.choice(sample_size, len(empty))]
+
+        self.centroids = centroids.astype(np.float32)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.lists = [[] for _ in range(nlist)]
+        self.positions = {}
+
+        assignment = self._assign(vectors, self.centroids, self.centroid_sq_norms)
+        for face_id, list_id in zip(face_ids.tolist(), assignment.tolist()):
+            self._append(face_id, list_id)
+        self.trained_size = count
+
+    def _append(self, face_id, list_id):
+        bucket = self.lists[list_id]
+        self.positions[face_id] = (list_id, len(bucket))
+        bucket.append(face_id)
+
+    def add(self, face_id, vector):
+        if not self.trained:
+            return
+        self.remove(face_id)
+        list_id = int(self._nearest_centroids(vector[None, :], 1)[0, 0])
+        self._append(face_id, list_id)
+
+    def remove(self, face_id):
+        position = self.positions.pop(face_id, None)
+        if position is None:
+            return
+        list_id, index = position
+        bucket = self.lists[list_id]
+        last_id = bucket.pop()
+        if last_id != face_id:
+            bucket[index] = last_id
+            self.positions[last_id] = (list_id, index)
+
+    def candidate_ids(self, queries):
+        """Ids dos rostos nas `nprobe` partições mais próximas de cada consulta"""
+        probes = self._nearest_centroids(queries, min(self.nprobe, len(self.lists)))
+        candidates = []
+        for list_id in np.unique(probes).tolist():
+            candidates.extend(self.lists[list_id])
+        return candidates
+
+
+class FaceGallery:
+    def __init__(self, dimension=128, initial_capacity=256):
+        self.dimension = dimension
+        self.size = 0
+        self.encodings = np.zeros((initial_capacity, dimension), dtype=np.float32)
+        self.sq_norms = np.zeros(initial_capacity, dtype=np.float32)
+        self.ids = np.zeros(initial_capacity, dtype=np.int64)
+        self.names = []
+        self.id_to_row = {}
+        self.index = None  # IVFIndex opcional para galerias grandes
+        self.ann_min_size = 0
+        # Treino em segundo plano: mudanças feitas durante o treino são reaplicadas no índice novo
+        self.index_lock = threading.Lock()
+        self.index_generation = 0  # Muda quando o conteúdo é substituído (descarta treinos em andamento)
+        self.training_thread = None
+        self.pending_changes = []  # (face_id, vetor ou None para remoção) durante o treino
+
+    def configure_ann(self, enabled=True, nlist=0, nprobe=8, min_size=5000):
+        """Ativa o índice aproximado; galerias menores que min_size usam força bruta"""
+        with self.index_lock:
+            self.index_generation += 1
+            self.pending_changes = []
+            self.index = IVFIndex(nlist=nlist, nprobe=nprobe) if enabled else None
+        self.ann_min_size = min_size
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, face_id):
+        return face_id in self.id_to_row
+
+    @property
+    def capacity(self):
+        return self.encodings.shape[0]
+
+    @property
+    def active_encodings(self):
+        """View (sem cópia) das linhas ocupadas da matriz"""
+        return self.encodings[:self.size]
+
+    @property
+    def active_ids(self):
+        return self.ids[:self.size]
+
+    def _ensure_capacity(self, required):
+        """Cresce a matriz dobrando a capacidade (custo amortizado O(1))"""
+        if required <= self.capacity:
+            return
+        new_capacity = max(required, self.capacity * 2, 16)
+
+        encodings = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        encodings[:self.size] = self.encodings[:self.size]
+        sq_norms = np.zeros(new_capacity, dtype=np.float32)
+        sq_norms[:self.size] = self.sq_norms[:self.size]
+        ids = np.zeros(new_capacity, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+
+        self.encodings, self.sq_norms, self.ids = encodings, sq_norms, ids
+
+    def load(self, faces):
+        """Substitui todo o conteúdo por uma lista de (id, nome, encoding)"""
+        faces = list(faces)
+        self.size = 0
+        self.names = []
+        self.id_to_row = {}
+        self._reset_index()
+        self._ensure_capacity(len(faces))
+
+        for face_id, name, encoding in faces:
+            self.add(face_id, name, encoding)
+
+    def adopt(self, encodings, sq_norms, ids, names, size):
+        """Substitui o conteúdo por matrizes prontas, sem copiar (ex.: snapshot memory-mapped)
+
+        As linhas além de `size` são a capacidade livre; as matrizes precisam
+        aceitar escrita (memory-map copy-on-write) para add/remove.
+        """
+        self.encodings, self.sq_norms, self.ids = encodings, sq_norms, ids
+        self.size = size
+        self.names = list(names)
+        self.id_to_row = {face_id: row for row, face_id in enumerate(ids[:size].tolist())}
+        self._reset_index()
+
+    def snapshot(self):
+        """Cópia das linhas ocupadas (encodings, normas, ids, nomes) para gravar em disco"""
+        return (self.encodings[:self.size].copy(), self.sq_norms[:self.size].copy(),
+                self.ids[:self.size].copy(), list(self.names))
+
+    def add(self, face_id, name, encoding):
+        """Adiciona (ou substitui) um rosto; retorna a linha ocupada"""
+        vector = np.asarray(encoding, dtype=np.float32).reshape(self.dimension)
+
+        row = self.id_to_row.get(face_id)
+        if row is None:
+            self._ensure_capacity(self.size + 1)
+            row = self.size
+            self.size += 1
+            self.names.append(name)
+            self.id_to_row[face_id] = row
+        else:
+            self.names[row] = name
+
+        self.encodings[row] = vector
+        self.sq_norms[row] = np.dot(vector, vector)
+        self.ids[row] = face_id
+        if self.index is not None:
+            self._index_change(face_id, vector)
+        return row
+
+    def remove(self, face_id):
+        """Remove um rosto movendo a última linha para o buraco (swap-remove)"""
+        row = self.id_to_row.pop(face_id, None)
+        if row is None:
+            return False
+        if self.index is not None:
+            self._index_change(face_id, None)
+
+        last = self.size - 1
+        if row != last:
+            self.encodings[row] = self.encodings[last]
+            self.sq_norms[row] = self.sq_norms[last]
+            self.ids[row] = self.ids[last]
+            self.names[row] = self.names[last]
+            self.id_to_row[int(self.ids[row])] = row
+
+        self.names.pop()
+        self.size = last
+        return True
+
+    def rename(self, face_id, name):
+        row = self.id_to_row.get(face_id)
+        if row is None:
+            return False
+        self.names[row] = name
+        return True
+
+    def distances(self, encoding):
+        """Distância euclidiana de um encoding para todos os rostos da galeria"""
+        if self.size == 0:
+            return np.empty(0, dtype=np.float32)
+
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dimension)
+        # |g - q|² = |g|² + |q|² - 2 g·q, usando as normas pré-calculadas
+        return np.sqrt(_squared_distances(self.active_encodings, self.sq_norms[:self.size], query))
+
+    def _reset_index(self):
+        with self.index_lock:
+            self.index_generation += 1
+            self.pending_changes = []
+            if self.index is not None:
+                self.index = self.index.empty_copy()
+
+    def _index_change(self, face_id, vector):
+        """Aplica uma inserção (vetor) ou remoção (None) no índice atual e registra para o treino em curso"""
+        with self.index_lock:
+            if vector is None:
+                self.index.remove(face_id)
+            else:
+                self.index.add(face_id, vector)
+            if self.training_thread is not None:
+                self.pending_changes.append((face_id, None if vector is None else vector.copy()))
+
+    def _start_training(self):
+        """Treina um índice novo em segundo plano sobre uma cópia dos vetores"""
+        with self.index_lock:
+            if self.training_thread is not None or self.index is None:
+                return
+            index = self.index.empty_copy()
+            vectors, face_ids = self.active_encodings.copy(), self.active_ids.copy()
+            self.pending_changes = []
+            self.training_thread = threading.Thread(
+                target=self._train_index, args=(index, vectors, face_ids, self.index_generation),
+                name="ivf-train", daemon=True
+            )
+            self.training_thread.start()
+
+    def _train_index(self, index, vectors, face_ids, generation):
+        try:
+            index.train(vectors, face_ids)
+        except Exception as e:
+            print(f"Erro ao treinar o índice da galeria: {e}")
+            index = None
+        with self.index_lock:
+            self.training_thread = None
+            pending, self.pending_changes = self.pending_changes, []
+            if index is None or generation != self.index_generation:
+                return  # Falhou ou a galeria foi recarregada durante o treino
+            # Reaplica o que mudou durante o treino e troca o índice de uma vez
+            for face_id, vector in pending:
+                if vector is None:
+                    index.remove(face_id)
+                else:
+                    index.add(face_id, vector)
+            self.index = index
+
+    def _use_index(self):
+        """Índice a usar na busca (None = força bruta), disparando o re-treino quando necessário
+
+        O treino roda em segundo plano; até ele terminar a busca usa o índice
+        anterior (mantido atualizado a cada inserção/remoção) ou força bruta.
+        """
+        index = self.index
+        if index is None or self.size < max(self.ann_min_size, 1):
+            return None
+        # Re-treina quando a galeria dobrou ou caiu pela metade desde o último treino
+        trained_size = index.trained_size
+        if not index.trained or self.size >= 2 * trained_size or self.size * 2 <= trained_size:
+            self._start_training()
+        return index if index.trained else None
+
+    def candidate_rows(self, queries):
+        """Linhas a comparar exatamente com as consultas (todas, sem índice)"""
+        index = self._use_index()
+        if index is None:
+            return None
+        candidate_ids = index.candidate_ids(queries)
+        return np.fromiter((self.id_to_row[face_id] for face_id in candidate_ids),
+                           dtype=np.int64, count=len(candidate_ids))
+
+    def best_match(self, encoding):
+        """Retorna (linha, distância) do rosto mais próximo, ou (None, None) se vazia"""
+        if self.size == 0:
+            return None, None
+
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dimension)
+        rows = self.candidate_rows(query[None, :])
+        if rows is None:
+            distances = self.distances(query)
+            row = int(np.argmin(distances))
+            return row, float(distances[row])
+        if len(rows) == 0:
+            return None, None
+
+        # Re-ranqueamento exato dos candidatos das partições visitadas
+        sq_distances = _squared_distances(self.encodings[rows], self.sq_norms[rows], query)
+        best = int(np.argmin(sq_distances))
+        return int(rows[best]), float(np.sqrt(sq_distances[best]))
+
+    def match_batch(self, encodings):
+        """Casa vários encodings de uma vez com uma única multiplicação de matrizes
+
+        Retorna (linhas, distâncias) com uma entrada por encoding; linha -1
+        indica que não há candidato (galeria vazia).
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dimension)
+        count = len(queries)
+        rows = np.full(count, -1, dtype=np.int64)
+        distances = np.full(count, np.inf, dtype=np.float32)
+        if count == 0 or self.size == 0:
+            return rows, distances
+
+        candidates = self.candidate_rows(queries)
+        if candidates is None:
+            points, sq_norms = self.active_encodings, self.sq_norms[:self.size]
+        elif len(candidates) == 0:
+            return rows, distances
+        else:
+            points, sq_norms = self.encodings[candidates], self.sq_norms[candidates]
+
+        # Matriz rostos x galeria: |q|² + |g|² - 2 Q·Gᵀ
+        query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+        sq_distances = query_sq_norms[:, None] + sq_norms[None, :] - 2.0 * (queries @ points.T)
+        best = np.argmin(sq_distances, axis=1)
+        best_sq = np.maximum(sq_distances[np.arange(count), best], 0.0)
+
+        rows = best if candidates is None else candidates[best]
+        return rows.astype(np.int64), np.sqrt(best_sq)
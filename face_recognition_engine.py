@@ -1,8 +1,13 @@
 import cv2
 import face_recognition
-import numpy as np
 from models import KnownFace, Sighting, Camera
-from datetime import datetime, timedelta
+from face_gallery import FaceGallery
+import detection_backend
+import sighting_writer
+import sighting_rollups
+import stats_cache
+from gallery_snapshot import GallerySnapshotStore, bump_version, current_version
+from datetime import datetime
 import base64
 import threading
 import time
@@ -11,91 +16,216 @@ class FaceRecognitionEngine:
     def __init__(self, user_id, app=None):
         self.user_id = user_id
         self.app = app  # Referência ao app Flask
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_face_ids = []
+        self.gallery = self._new_gallery()  # Matriz float32 contígua com os rostos conhecidos
         self.last_detection_times = {}  # Para evitar detecções duplicadas
         self.last_face_locations = []  # Para armazenar localizações dos rostos
         self.lock = threading.Lock()  # Para thread safety
+        self.throttle_lock = threading.Lock()  # Protege last_detection_times
+        self.snapshot_store = self._new_snapshot_store()
+        self.synced_version = None  # Versão do contador de mudanças refletida na galeria (None = divergiu)
+        self.snapshot_dirty = False  # Galeria mudou desde o último snapshot gravado
         if app:
             with app.app_context():
                 self.load_known_faces()
         else:
             self.load_known_faces()
     
-    def load_known_faces(self):
-        """Carrega os rostos conhecidos do usuário do banco de dados"""
-        with self.lock:
-            faces = KnownFace.query.filter_by(user_id=self.user_id).all()
-            self.known_face_encodings = []
-            self.known_face_names = []
-            self.known_face_ids = []
-            
-            for face in faces:
-                try:
-                    encoding = face.get_face_encoding()
-                    self.known_face_encodings.append(encoding)
-                    self.known_face_names.append(face.name)
-                    self.known_face_ids.append(face.id)
-                except Exception as e:
-                    print(f"Erro ao carregar rosto {face.id}: {e}")
-            
-            print(f"Carregados {len(self.known_face_names)} rostos conhecidos para usuário {self.user_id}")
+    def _new_gallery(self):
+        """Cria uma galeria vazia com o índice aproximado configurado no app"""
+        gallery = FaceGallery()
+        config = self.app.config if self.app else {}
+        if config.get('FACE_ANN_ENABLED', False):
+            gallery.configure_ann(
+                nlist=config.get('FACE_ANN_NLIST', 0),
+                nprobe=config.get('FACE_ANN_NPROBE', 8),
+                min_size=config.get('FACE_ANN_MIN_SIZE', 5000)
+            )
+        return gallery
     
-    def process_frame(self, frame, camera_id):
-        """Processa um frame e retorna o frame com as detecções"""
+    def _new_snapshot_store(self):
+        """Snapshot em disco da galeria (None se GALLERY_SNAPSHOT_DIR estiver vazio)"""
+        directory = self.app.config.get('GALLERY_SNAPSHOT_DIR') if self.app else None
+        return GallerySnapshotStore(directory) if directory else None
+    
+    @property
+    def known_face_names(self):
+        return list(self.gallery.names)
+    
+    @property
+    def known_face_ids(self):
+        return self.gallery.active_ids.tolist()
+    
+    def load_known_faces(self):
+        """Carrega os rostos conhecidos do usuário (snapshot em disco ou recarga completa do banco)"""
         from models import db
         
-        # Redimensiona para processamento mais rápido
-        scale_factor = 0.5  # Melhor escala para manter precisão
-        small_frame = cv2.resize(frame, (0, 0), fx=scale_factor, fy=scale_factor)
-        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+        # Lida antes da consulta: uma mudança no meio deixa o snapshot com versão antiga (recarga na próxima vez)
+        version = current_version(db.session, self.user_id) if self.snapshot_store else None
+        if self.snapshot_store:
+            snapshot = self.snapshot_store.load(self.user_id, version)
+            if snapshot is not None:
+                gallery = self._new_gallery()
+                gallery.adopt(*snapshot)
+                with self.lock:
+                    self.gallery = gallery
+                    self.synced_version = version
+                    self.snapshot_dirty = False
+                print(f"Carregados {len(gallery)} rostos conhecidos para usuário {self.user_id} (snapshot v{version})")
+                return
+        
+        faces = KnownFace.query.filter_by(user_id=self.user_id).all()
+        
+        # Monta a nova galeria fora do lock para não travar as câmeras durante a consulta
+        gallery = self._new_gallery()
+        entries = []
+        for face in faces:
+            try:
+                entries.append((face.id, face.name, face.get_face_encoding()))
+            except Exception as e:
+                print(f"Erro ao carregar rosto {face.id}: {e}")
+        gallery.load(entries)
+        
+        with self.lock:
+            self.gallery = gallery
+            self.synced_version = version
+            self.snapshot_dirty = True
         
-        # Encontra rostos
-        face_locations = face_recognition.face_locations(rgb_small_frame, model="hog")
-        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+        print(f"Carregados {len(gallery)} rostos conhecidos para usuário {self.user_id}")
+        self.save_snapshot()
+    
+    def _advance_version(self, version):
+        """Acompanha o contador após uma mudança local (chamar com self.lock)
+
+        Só continua sincronizada se a mudança for exatamente a próxima versão;
+        mudanças de outros processos no meio impedem gravar o snapshot.
+        """
+        if version is not None and self.synced_version is not None and version == self.synced_version + 1:
+            self.synced_version = version
+        else:
+            self.synced_version = None
+        self.snapshot_dirty = True
+    
+    def save_snapshot(self):
+        """Grava o snapshot da galeria se ela mudou e ainda corresponde a uma versão do contador"""
+        if self.snapshot_store is None:
+            return False
+        with self.lock:
+            if not self.snapshot_dirty or self.synced_version is None:
+                return False
+            version = self.synced_version
+            encodings, sq_norms, ids, names = self.gallery.snapshot()
+            self.snapshot_dirty = False
         
-        # Escala localizações de volta para tamanho original
-        scaled_locations = []
-        for top, right, bottom, left in face_locations:
-            scaled_locations.append((
-                int(top / scale_factor),
-                int(right / scale_factor), 
-                int(bottom / scale_factor),
-                int(left / scale_factor)
-            ))
+        # Grava fora do lock: a cópia acima já é consistente
+        saved = self.snapshot_store.save(self.user_id, version, encodings, sq_norms, ids, names)
+        if saved:
+            print(f"Snapshot da galeria do usuário {self.user_id} gravado (v{version}, {len(names)} rostos)")
+        return saved
+    
+    def add_known_face(self, face_id, name, encoding, version=None):
+        """Adiciona um rosto à galeria em memória sem recarregar do banco
+
+        `version` é o valor do contador de mudanças retornado por bump_version
+        na transação que gravou o rosto.
+        """
+        with self.lock:
+            self.gallery.add(face_id, name, encoding)
+            self._advance_version(version)
+        stats_cache.invalidate(self.user_id)
+    
+    def remove_known_face(self, face_id, version=None):
+        """Remove um rosto da galeria em memória sem recarregar do banco"""
+        with self.lock:
+            removed = self.gallery.remove(face_id)
+            self._advance_version(version)
+        stats_cache.invalidate(self.user_id)
+        
+        # Descarta o throttling de avistamentos do rosto removido
+        with self.throttle_lock:
+            prefix = f"{face_id}_"
+            for key in [k for k in self.last_detection_times if k.startswith(prefix)]:
+                del self.last_detection_times[key]
+        return removed
+    
+    def process_frame(self, frame, camera_id):
+        """Processa um frame e retorna o frame com as detecções"""
+        scaled_locations, face_encodings = self.detect_and_encode(frame)
         
         # Armazena localizações para uso em threads
         self.last_face_locations = scaled_locations.copy()
         
-        face_names = []
-        detected_face_ids = []
+        face_names, detected_face_ids = self.identify_faces(face_encodings, camera_id)
         
-        current_time = datetime.utcnow()
+        # Não desenha mais aqui - será feito no app.py para controle total das cores
+        return frame, face_names, detected_face_ids
+    
+    def detect_and_encode(self, frame, scale_factor=None):
+        """Detecta os rostos do frame e calcula seus encodings de 128 dimensões
+
+        A detecção roda no frame reduzido por scale_factor e o encoding em recortes
+        na resolução original. O trabalho pesado roda no backend configurado
+        (local ou pool de processos).
+        """
+        if scale_factor is None:
+            scale_factor = detection_backend.detection_scale()
+        return detection_backend.get_backend().detect_and_encode(frame, scale_factor)
+    
+    def detect_faces(self, frame, scale_factor=None):
+        """Só detecta os rostos (localizações no tamanho original), sem encoding"""
+        if scale_factor is None:
+            scale_factor = detection_backend.detection_scale()
+        return detection_backend.get_backend().detect(frame, scale_factor)
+    
+    def encode_faces(self, frame, face_locations):
+        """Calcula os encodings apenas dos rostos indicados"""
+        return detection_backend.get_backend().encode(frame, face_locations)
+    
+    def identify_faces(self, face_encodings, camera_id):
+        """Identifica todos os encodings de um frame contra a galeria de uma só vez"""
+        names, face_ids, _ = self.identify_many([(face_encodings, camera_id)])[0]
+        return names, face_ids
+    
+    def identify_many(self, requests):
+        """Identifica os encodings de vários frames (lista de (encodings, camera_id)) em um único lote
+
+        Retorna, para cada frame, (nomes, ids, distâncias da melhor correspondência).
+        """
+        all_encodings = [encoding for face_encodings, _ in requests for encoding in face_encodings]
+        names = ["Desconhecido"] * len(all_encodings)
+        face_ids = [None] * len(all_encodings)
+        distances = [None] * len(all_encodings)
         
-        for face_encoding in face_encodings:
-            name = "Desconhecido"
-            face_id = None
-            
+        if all_encodings:
+            # Seção crítica curta: só a matriz de distâncias e a cópia dos resultados
             with self.lock:
-                if len(self.known_face_encodings) > 0:
-                    # Calcula distâncias
-                    face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                    best_match_index = np.argmin(face_distances)
-                    
+                best_rows, best_distances = self.gallery.match_batch(all_encodings)
+                for i, (row, distance) in enumerate(zip(best_rows.tolist(), best_distances.tolist())):
+                    if row < 0:
+                        continue
+                    distances[i] = distance
                     # Verifica se a melhor correspondência está dentro do limite
-                    if face_distances[best_match_index] < 0.6:  # Limite mais flexível para melhor detecção
-                        name = self.known_face_names[best_match_index]
-                        face_id = self.known_face_ids[best_match_index]
-                        
-                        # Registra o avistamento (com throttling)
-                        self.register_sighting_throttled(face_id, camera_id, current_time)
-            
-            face_names.append(name)
-            detected_face_ids.append(face_id)
+                    if distance < 0.6:  # Limite mais flexível para melhor detecção
+                        names[i] = self.gallery.names[row]
+                        face_ids[i] = int(self.gallery.ids[row])
         
-        # Não desenha mais aqui - será feito no app.py para controle total das cores
-        return frame, face_names, detected_face_ids
+        # Separa os resultados por frame e registra os avistamentos fora do lock da galeria
+        results = []
+        offset = 0
+        for face_encodings, camera_id in requests:
+            count = len(face_encodings)
+            frame_ids = face_ids[offset:offset + count]
+            results.append((names[offset:offset + count], frame_ids, distances[offset:offset + count]))
+            offset += count
+            self.register_sightings(frame_ids, camera_id)
+        
+        return results
+    
+    def register_sightings(self, face_ids, camera_id):
+        """Registra (com throttling) os avistamentos dos rostos identificados em um frame"""
+        current_time = datetime.utcnow()
+        for face_id in set(face_ids):
+            if face_id is not None:
+                self.register_sighting_throttled(face_id, camera_id, current_time)
     
     def draw_detections(self, frame, face_locations, face_names, scale_factor):
         """Desenha as caixas e nomes dos rostos no frame"""
@@ -132,15 +262,28 @@ class FaceRecognitionEngine:
         """Registra um avistamento com throttling para evitar spam"""
         key = f"{face_id}_{camera_id}"
         
-        # Verifica se já foi detectado recentemente (últimos 60 segundos para reduzir carga)
-        if key in self.last_detection_times:
-            time_diff = current_time - self.last_detection_times[key]
-            if time_diff.total_seconds() < 60:
+        with self.throttle_lock:
+            # Verifica se já foi detectado recentemente (últimos 60 segundos para reduzir carga)
+            previous_time = self.last_detection_times.get(key)
+            if previous_time is not None and (current_time - previous_time).total_seconds() < 60:
                 return  # Muito recente, ignora
-        
-        # Registra o avistamento
-        if self.register_sighting(face_id, camera_id, current_time):
+            # Reserva o intervalo antes de ir ao banco para evitar registros duplicados
             self.last_detection_times[key] = current_time
+        
+        # Enfileira no gravador em segundo plano: a detecção não espera o banco
+        if self.app:
+            accepted = sighting_writer.get_writer(self.app).enqueue(face_id, camera_id, current_time, self.user_id)
+        else:
+            accepted = self.register_sighting(face_id, camera_id, current_time)
+        
+        if not accepted:
+            # Recusado (fila cheia): libera o intervalo para a próxima detecção tentar de novo
+            with self.throttle_lock:
+                if self.last_detection_times.get(key) == current_time:
+                    if previous_time is None:
+                        del self.last_detection_times[key]
+                    else:
+                        self.last_detection_times[key] = previous_time
     
     def create_unknown_face(self, face_encoding):
         """Cria um novo rosto desconhecido no banco"""
@@ -150,10 +293,9 @@ class FaceRecognitionEngine:
             try:
                 # Verifica se já existe um rosto muito similar
                 with self.lock:
-                    for known_encoding in self.known_face_encodings:
-                        distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
-                        if distance < 0.5:
-                            return None  # Já existe um rosto similar
+                    _, distance = self.gallery.best_match(face_encoding)
+                if distance is not None and distance < 0.5:
+                    return None  # Já existe um rosto similar
                 
                 # Conta quantos desconhecidos já existem
                 unknown_count = KnownFace.query.filter(
@@ -168,10 +310,11 @@ class FaceRecognitionEngine:
                 new_face.set_face_encoding(face_encoding)
                 
                 db.session.add(new_face)
+                version = bump_version(db.session, self.user_id)
                 db.session.commit()
                 
-                # Atualiza a lista local
-                self.load_known_faces()
+                # Atualiza a galeria local de forma incremental
+                self.add_known_face(new_face.id, new_face.name, face_encoding, version)
                 
                 print(f"Novo rosto desconhecido criado: {new_face.name} (ID: {new_face.id})")
                 return new_face.id
@@ -192,16 +335,15 @@ class FaceRecognitionEngine:
         
         def _register_sighting():
             try:
-                if timestamp is None:
-                    timestamp = datetime.utcnow()
-                
                 sighting = Sighting(
                     face_id=face_id,
                     camera_id=camera_id,
-                    timestamp=timestamp
+                    timestamp=timestamp or datetime.utcnow()
                 )
                 db.session.add(sighting)
+                sighting_rollups.add_counts(db.session, sighting_rollups.aggregate([sighting]))
                 db.session.commit()
+                stats_cache.invalidate(self.user_id)
                 
                 return True
             except Exception as e:
@@ -299,11 +441,11 @@ class FaceRecognitionEngine:
                 # Verifica se o rosto já está cadastrado
                 face_encoding = face_encodings[0]
                 with self.lock:
-                    for i, known_encoding in enumerate(self.known_face_encodings):
-                        distance = face_recognition.face_distance([known_encoding], face_encoding)[0]
-                        if distance < 0.5:
-                            print(f"⚠️ Rosto já cadastrado: {self.known_face_names[i]}")
-                            return None, f"Este rosto já está cadastrado como: {self.known_face_names[i]}"
+                    best_row, distance = self.gallery.best_match(face_encoding)
+                    existing_name = self.gallery.names[best_row] if best_row is not None else None
+                if distance is not None and distance < 0.5:
+                    print(f"⚠️ Rosto já cadastrado: {existing_name}")
+                    return None, f"Este rosto já está cadastrado como: {existing_name}"
                 
                 print("✅ Novo rosto detectado, processando...")
                 
@@ -359,10 +501,11 @@ class FaceRecognitionEngine:
                 new_face.set_face_encoding(face_data['encoding'])
                 
                 db.session.add(new_face)
+                version = bump_version(db.session, self.user_id)
                 db.session.commit()
                 
-                # Atualiza a lista local
-                self.load_known_faces()
+                # Atualiza a galeria local de forma incremental
+                self.add_known_face(new_face.id, name, face_data['encoding'], version)
                 
                 print(f"Novo rosto cadastrado: {name} (ID: {new_face.id})")
                 return True, f"Rosto de {name} cadastrado com sucesso!"
@@ -378,16 +521,13 @@ class FaceRecognitionEngine:
     
     def get_statistics(self):
         """Retorna estatísticas do sistema"""
-        total_faces = len(self.known_face_names)
-        unknown_faces = len([name for name in self.known_face_names if name.startswith('Desconhecido_')])
+        face_names = self.known_face_names
+        total_faces = len(face_names)
+        unknown_faces = len([name for name in face_names if name.startswith('Desconhecido_')])
         known_faces = total_faces - unknown_faces
         
-        # Avistamentos das últimas 24 horas
-        yesterday = datetime.utcnow() - timedelta(days=1)
-        recent_sightings = Sighting.query.join(KnownFace).filter(
-            KnownFace.user_id == self.user_id,
-            Sighting.timestamp >= yesterday
-        ).count()
+        # Avistamentos das últimas 24 horas (lidos dos agregados por hora)
+        recent_sightings = sighting_rollups.recent_count(self.user_id, hours=24)
         
         return {
             'total_faces': total_faces,
@@ -0,0 +1,107 @@
+"""
+Rastreador de rostos por câmera (IoU)
+Mantém a identidade de cada rosto entre passes de detecção para que o encoding
+(a etapa mais cara) só seja refeito quando surge uma trilha nova, quando a
+confiança da identificação é baixa ou a cada N passes.
+"""
+
+import itertools
+import numpy as np
+
+
+class Track:
+    def __init__(self, track_id, location):
+        self.track_id = track_id
+        self.location = location
+        self.name = "Desconhecido"
+        self.face_id = None
+        self.distance = None  # Distância da última identificação (menor = mais confiável)
+        self.passes_since_encode = 0
+        self.missed = 0
+        self.encoded = False
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU entre duas listas de caixas (top, right, bottom, left)"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 1] - a[:, 3]) * (a[:, 2] - a[:, 0])
+    area_b = (b[:, 1] - b[:, 3]) * (b[:, 2] - b[:, 0])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-6), 0.0)
+
+
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, reencode_interval=10, max_missed=3, confidence_distance=0.5):
+        self.iou_threshold = iou_threshold
+        self.reencode_interval = reencode_interval  # Passes de detecção entre re-encodings de uma trilha
+        self.max_missed = max_missed  # Passes sem detecção antes de descartar a trilha
+        self.confidence_distance = confidence_distance  # Acima disso a identificação é considerada fraca
+        self.tracks = []
+        self.track_ids = itertools.count(1)
+        self.stats = {'detections': 0, 'encoded': 0}
+
+    def update(self, locations):
+        """Associa as detecções às trilhas existentes
+
+        Retorna (trilha de cada detecção, índices das detecções que precisam de encoding).
+        """
+        matched = [None] * len(locations)
+        unmatched_tracks = set(range(len(self.tracks)))
+
+        if self.tracks and locations:
+            ious = iou_matrix([t.location for t in self.tracks], locations)
+            # Associação gulosa pelos maiores IoU
+            for flat in np.argsort(ious, axis=None)[::-1]:
+                track_index, detection_index = np.unravel_index(flat, ious.shape)
+                if ious[track_index, detection_index] < self.iou_threshold:
+                    break
+                if track_index in unmatched_tracks and matched[detection_index] is None:
+                    matched[detection_index] = self.tracks[track_index]
+                    unmatched_tracks.discard(track_index)
+
+        # Trilhas não vistas envelhecem e são descartadas depois de max_missed passes
+        for track_index in unmatched_tracks:
+            self.tracks[track_index].missed += 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+
+        to_encode = []
+        for index, location in enumerate(locations):
+            track = matched[index]
+            if track is None:
+                track = Track(next(self.track_ids), location)
+                self.tracks.append(track)
+                matched[index] = track
+            else:
+                track.location = location
+                track.missed = 0
+                track.passes_since_encode += 1
+
+            if self._needs_encoding(track):
+                to_encode.append(index)
+
+        self.stats['detections'] += len(locations)
+        self.stats['encoded'] += len(to_encode)
+        return matched, to_encode
+
+    def _needs_encoding(self, track):
+        if not track.encoded:
+            return True  # Trilha nova
+        if track.passes_since_encode >= self.reencode_interval:
+            return True
+        # Identificação fraca (casou, mas longe do centro da galeria)
+        return (track.face_id is not None and track.distance is not None
+                and track.distance > self.confidence_distance)
+
+    def assign(self, track, name, face_id, distance):
+        """Grava o resultado de um encoding + identificação na trilha"""
+        track.name = name
+        track.face_id = face_id
+        track.distance = distance
+        track.passes_since_encode = 0
+        track.encoded = True
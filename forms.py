@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, SelectField, IntegerField
-from wtforms.validators import DataRequired, Length, ValidationError
+from wtforms import StringField, PasswordField, SubmitField, SelectField, IntegerField, FloatField
+from wtforms.validators import DataRequired, Length, ValidationError, Optional, NumberRange
 from models import User, Establishment, Camera
 
 class LoginForm(FlaskForm):
@@ -27,6 +27,10 @@ class CameraForm(FlaskForm):
     camera_source = StringField('Fonte da Câmera', validators=[DataRequired()], 
                                render_kw={"placeholder": "Ex: 0 para webcam, ou URL do stream"})
     establishment_id = SelectField('Estabelecimento', coerce=int, validators=[DataRequired()])
+    motion_threshold = FloatField('Limiar de Movimento (% de pixels alterados)', validators=[Optional(), NumberRange(min=0, max=100)],
+                                  render_kw={"placeholder": "Padrão do servidor (maior = menos sensível, 0 = sempre detecta)"})
+    min_face_size = IntegerField('Tamanho Mínimo do Rosto (px)', validators=[Optional(), NumberRange(min=20, max=2000)],
+                                 render_kw={"placeholder": "Padrão do servidor"})
     submit = SubmitField('Salvar')
     
     def __init__(self, user_id, *args, **kwargs):
@@ -0,0 +1,93 @@
+"""
+Ring buffer de frames pré-alocado por câmera
+A captura escreve direto em um slot (cap.read(image=slot)) e os consumidores
+leem por número de sequência, sem cópias. Opcionalmente o buffer fica em
+multiprocessing.shared_memory para ser lido por outros processos.
+
+Layout da memória: cabeçalho int64 [última sequência, sequência de cada slot...]
+seguido dos slots de frames.
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class FrameRingBuffer:
+    def __init__(self, shape, dtype=np.uint8, slots=8, shared=False, name=None, create=True):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.shm = None
+        self.owner = create
+
+        header_bytes = 8 * (slots + 1)
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        total_bytes = header_bytes + slots * frame_bytes
+
+        if shared:
+            if create:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=total_bytes)
+            else:
+                self.shm = shared_memory.SharedMemory(name=name)
+            buffer = self.shm.buf
+        else:
+            buffer = bytearray(total_bytes)
+
+        self.header = np.ndarray((slots + 1,), dtype=np.int64, buffer=buffer)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=buffer, offset=header_bytes)
+        if create:
+            self.header[:] = -1
+
+    @classmethod
+    def attach(cls, name, shape, dtype=np.uint8, slots=8):
+        """Abre (em outro processo) um ring buffer criado com shared=True"""
+        return cls(shape, dtype=dtype, slots=slots, shared=True, name=name, create=False)
+
+    @property
+    def name(self):
+        return self.shm.name if self.shm else None
+
+    @property
+    def latest_sequence(self):
+        return int(self.header[0])
+
+    def next_slot(self):
+        """Reserva o próximo slot para escrita; retorna (sequência, view do slot)"""
+        sequence = self.latest_sequence + 1
+        slot = sequence % self.slots
+        self.header[1 + slot] = -1  # Slot em escrita: leitores antigos deixam de ser válidos
+        return sequence, self.frames[slot]
+
+    def commit(self, sequence):
+        """Publica o slot escrito para os leitores"""
+        self.header[1 + sequence % self.slots] = sequence
+        self.header[0] = sequence
+
+    def write(self, frame):
+        """Copia um frame para o próximo slot (para quando não dá para capturar direto nele)"""
+        sequence, slot = self.next_slot()
+        np.copyto(slot, frame)
+        self.commit(sequence)
+        return sequence
+
+    def read_latest(self):
+        """Retorna (sequência, view) do frame mais recente, ou (None, None) se vazio"""
+        sequence = self.latest_sequence
+        if sequence < 0:
+            return None, None
+        return sequence, self.frames[sequence % self.slots]
+
+    def is_valid(self, sequence):
+        """Indica se o slot de uma sequência ainda não foi sobrescrito"""
+        return sequence is not None and sequence >= 0 and int(self.header[1 + sequence % self.slots]) == sequence
+
+    def close(self):
+        if self.shm is None:
+            return
+        # Solta as views antes de fechar o mapeamento
+        self.header = None
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
@@ -0,0 +1,125 @@
+"""
+Snapshot em disco da galeria de rostos de cada usuário
+Cada versão é um diretório com as matrizes da galeria em .npy (encodings,
+normas e ids) e os nomes em meta.json. O engine abre as matrizes com
+memory-map (copy-on-write) em vez de ler e decodificar todos os BLOBs do
+banco: a partida não depende do tamanho da galeria e processos diferentes
+compartilham as mesmas páginas do cache do sistema operacional.
+
+A versão é o contador de mudanças do usuário (tabela gallery_versions),
+incrementado na mesma transação de cada inserção ou remoção de rosto. Um
+snapshot só é usado se a versão dele for igual à do contador; caso contrário
+a galeria é recarregada do banco e um novo snapshot é gravado.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+from sqlalchemy import select
+
+META_FILE = 'meta.json'
+MIN_SLACK = 256  # Linhas livres no fim das matrizes para inserções sem realocar
+
+
+def bump_version(session, user_id):
+    """Incrementa o contador de mudanças da galeria na transação atual; retorna o novo valor"""
+    from models import GalleryVersion
+
+    table = GalleryVersion.__table__
+    result = session.execute(
+        table.update().where(table.c.user_id == user_id).values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        session.execute(table.insert().values(user_id=user_id, version=1))
+    return session.execute(select(table.c.version).where(table.c.user_id == user_id)).scalar()
+
+
+def current_version(session, user_id):
+    """Valor atual do contador (0 se o usuário nunca alterou a galeria)"""
+    from models import GalleryVersion
+
+    table = GalleryVersion.__table__
+    version = session.execute(select(table.c.version).where(table.c.user_id == user_id)).scalar()
+    return version or 0
+
+
+class GallerySnapshotStore:
+    def __init__(self, directory, keep_versions=2):
+        self.directory = directory
+        self.keep_versions = keep_versions  # Versões antigas mantidas para processos que ainda as mapeiam
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.directory, f"user_{user_id}")
+
+    def _versions(self, user_id):
+        """Versões gravadas do usuário, da mais nova para a mais antiga"""
+        try:
+            names = os.listdir(self._user_dir(user_id))
+        except FileNotFoundError:
+            return []
+        return sorted((int(name[1:]) for name in names if name[:1] == 'v' and name[1:].isdigit()), reverse=True)
+
+    def load(self, user_id, version):
+        """Abre o snapshot da versão com memory-map; None se não existir ou estiver incompleto
+
+        Retorna (encodings, sq_norms, ids, nomes, tamanho). As matrizes são
+        copy-on-write: escritas (rostos novos/removidos) ficam só no processo.
+        """
+        path = os.path.join(self._user_dir(user_id), f"v{version}")
+        try:
+            with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            encodings = np.load(os.path.join(path, 'encodings.npy'), mmap_mode='c')
+            sq_norms = np.load(os.path.join(path, 'sq_norms.npy'), mmap_mode='c')
+            ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode='c')
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Snapshot da galeria do usuário {user_id} (v{version}) ilegível: {e}")
+            return None
+
+        size = meta['size']
+        if meta['version'] != version or len(meta['names']) != size or not (
+                size <= len(encodings) == len(sq_norms) == len(ids)):
+            return None
+        return encodings, sq_norms, ids, meta['names'], size
+
+    def save(self, user_id, version, encodings, sq_norms, ids, names):
+        """Grava uma versão (diretório temporário + rename atômico) e remove as antigas"""
+        user_dir = self._user_dir(user_id)
+        final_path = os.path.join(user_dir, f"v{version}")
+        if os.path.isdir(final_path):
+            return False  # Outro processo já gravou esta versão
+
+        size = len(names)
+        capacity = size + max(MIN_SLACK, size // 4)
+        temp_path = os.path.join(user_dir, f".v{version}.{os.getpid()}.tmp")
+        os.makedirs(temp_path, exist_ok=True)
+        try:
+            for name, array, dtype, shape in (
+                ('encodings.npy', encodings, np.float32, (capacity, encodings.shape[1])),
+                ('sq_norms.npy', sq_norms, np.float32, (capacity,)),
+                ('ids.npy', ids, np.int64, (capacity,)),
+            ):
+                # Escreve direto no arquivo, sem montar a matriz com folga em memória
+                target = np.lib.format.open_memmap(os.path.join(temp_path, name), mode='w+',
+                                                   dtype=dtype, shape=shape)
+                target[:size] = array[:size]
+                target.flush()
+                del target
+            with open(os.path.join(temp_path, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'version': version, 'size': size, 'dimension': int(encodings.shape[1]),
+                           'names': list(names)}, f, ensure_ascii=False)
+            os.rename(temp_path, final_path)
+        except OSError as e:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            if os.path.isdir(final_path):
+                return False
+            print(f"Erro ao gravar snapshot da galeria do usuário {user_id}: {e}")
+            return False
+
+        # Arquivos já mapeados por outros processos continuam válidos após a remoção
+        for old_version in self._versions(user_id)[self.keep_versions:]:
+            shutil.rmtree(os.path.join(user_dir, f"v{old_version}"), ignore_errors=True)
+        return True
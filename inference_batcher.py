@@ -0,0 +1,191 @@
+"""
+Estágio central de inferência compartilhado por todas as câmeras
+Junta os frames pendentes de várias câmeras em lotes (respeitando um prazo
+máximo de espera), executa detecção + encoding e faz o casamento com a galeria
+de cada usuário em uma única operação por lote.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+
+class InferenceRequest:
+    def __init__(self, camera_id, engine, frame, tracker=None, scale_factor=None):
+        self.camera_id = camera_id
+        self.engine = engine
+        self.frame = frame
+        self.tracker = tracker  # FaceTracker opcional da câmera
+        self.scale_factor = scale_factor  # Escala de detecção da câmera (None = padrão)
+        self.submitted_at = time.monotonic()
+        self.future = Future()
+
+
+class InferenceBatcher:
+    def __init__(self, max_batch_size=8, max_latency=0.05, workers=None):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency  # Segundos que o primeiro pedido pode esperar pelo lote
+        self.workers = workers or os.cpu_count() or 1
+        self.pending = {}  # camera_id -> InferenceRequest (só o frame mais recente)
+        self.in_progress = set()  # Câmeras com frame em processamento (uma de cada vez)
+        self.condition = threading.Condition()
+        self.threads = []
+        self.detection_times = {}  # camera_id -> segundos de detecção + encoding do último frame (sem fila)
+        self.stats = {'batches': 0, 'frames': 0, 'replaced': 0}
+
+    def start(self):
+        """Inicia as threads de inferência (chamado automaticamente no primeiro pedido)"""
+        with self.condition:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"inference-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        print(f"Batcher de inferência iniciado ({self.workers} threads, lote máx. {self.max_batch_size})")
+
+    def submit(self, camera_id, engine, frame, tracker=None, scale_factor=None):
+        """Enfileira um frame; retorna um Future com (localizações, nomes, ids)
+
+        Se a câmera já tiver um frame esperando, ele é substituído pelo novo
+        (o Future antigo recebe o resultado do frame mais recente). Com um
+        tracker, só os rostos de trilhas novas ou vencidas são re-encodados.
+        """
+        if not self.threads:
+            self.start()
+
+        request = InferenceRequest(camera_id, engine, frame, tracker, scale_factor)
+        with self.condition:
+            previous = self.pending.pop(camera_id, None)
+            if previous is not None:
+                # Mantém a posição na fila (e o prazo) do pedido substituído
+                request.submitted_at = previous.submitted_at
+                request.future.add_done_callback(lambda f, old=previous.future: _copy_result(f, old))
+                self.stats['replaced'] += 1
+            self.pending[camera_id] = request
+            self.condition.notify()
+        return request.future
+
+    def detection_time(self, camera_id):
+        """Custo do último passe da câmera (sem o tempo de espera na fila do lote)"""
+        return self.detection_times.get(camera_id, 0.0)
+
+    def _collect_batch(self):
+        """Espera até ter um lote cheio ou até o prazo do pedido mais antigo vencer"""
+        with self.condition:
+            while not self._ready_requests():
+                self.condition.wait()
+
+            deadline = min(r.submitted_at for r in self._ready_requests()) + self.max_latency
+            while len(self._ready_requests()) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+                if not self._ready_requests():
+                    return []
+
+            oldest_first = sorted(self._ready_requests(), key=lambda r: r.submitted_at)
+            batch = oldest_first[:self.max_batch_size]
+            for request in batch:
+                del self.pending[request.camera_id]
+                self.in_progress.add(request.camera_id)
+            return batch
+
+    def _ready_requests(self):
+        """Pedidos pendentes de câmeras que não estão sendo processadas agora"""
+        return [r for r in self.pending.values() if r.camera_id not in self.in_progress]
+
+    def _worker_loop(self):
+        while True:
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            try:
+                self._process_batch(batch)
+            except Exception as e:
+                # Não deixa a thread morrer (o pool encolheria) nem pedidos sem resposta
+                print(f"Erro no lote de inferência: {e}")
+                _fail_pending(batch, e)
+            finally:
+                with self.condition:
+                    for request in batch:
+                        self.in_progress.discard(request.camera_id)
+                    self.condition.notify_all()
+
+    def _detect(self, request):
+        """Detecta e encoda; com tracker, encoda só as detecções que precisam"""
+        engine, frame, tracker = request.engine, request.frame, request.tracker
+        if tracker is None:
+            locations, encodings = engine.detect_and_encode(frame, request.scale_factor)
+            return locations, encodings, None, list(range(len(locations)))
+
+        locations = engine.detect_faces(frame, request.scale_factor)
+        tracks, to_encode = tracker.update(locations)
+        encodings = engine.encode_faces(frame, [locations[i] for i in to_encode])
+        return locations, encodings, tracks, to_encode
+
+    def _process_batch(self, batch):
+        detections = []
+        for request in batch:
+            try:
+                started = time.monotonic()
+                detections.append((request,) + self._detect(request))
+                self.detection_times[request.camera_id] = time.monotonic() - started
+            except Exception as e:
+                print(f"Erro na detecção da câmera {request.camera_id}: {e}")
+                request.future.set_exception(e)
+
+        # Agrupa por engine (usuário) para casar todos os rostos do lote de uma vez
+        by_engine = {}
+        for item in detections:
+            by_engine.setdefault(id(item[0].engine), []).append(item)
+
+        for items in by_engine.values():
+            engine = items[0][0].engine
+            try:
+                results = engine.identify_many([(encodings, request.camera_id)
+                                                for request, _, encodings, _, _ in items])
+            except Exception as e:
+                print(f"Erro na identificação em lote: {e}")
+                for request, _, _, _, _ in items:
+                    request.future.set_exception(e)
+                continue
+
+            for (request, locations, _, tracks, to_encode), (names, ids, distances) in zip(items, results):
+                try:
+                    if tracks is None:
+                        request.future.set_result((locations, names, ids))
+                        continue
+
+                    for index, name, face_id, distance in zip(to_encode, names, ids, distances):
+                        request.tracker.assign(tracks[index], name, face_id, distance)
+                    # Rostos mantidos pelo tracker continuam gerando avistamentos (com throttling)
+                    encoded = set(to_encode)
+                    engine.register_sightings([t.face_id for i, t in enumerate(tracks) if i not in encoded],
+                                              request.camera_id)
+                    request.future.set_result((locations, [t.name for t in tracks], [t.face_id for t in tracks]))
+                except Exception as e:
+                    print(f"Erro ao finalizar o frame da câmera {request.camera_id}: {e}")
+                    _fail_pending([request], e)
+
+        self.stats['batches'] += 1
+        self.stats['frames'] += len(batch)
+
+
+def _fail_pending(requests, error):
+    """Repassa o erro aos pedidos que ainda não receberam resultado"""
+    for request in requests:
+        if not request.future.done():
+            request.future.set_exception(error)
+
+
+def _copy_result(source, target):
+    """Repassa o resultado de um Future para outro (usado em pedidos substituídos)"""
+    if target.done():
+        return
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
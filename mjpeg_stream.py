@@ -0,0 +1,119 @@
+"""
+Streaming MJPEG (multipart/x-mixed-replace) das câmeras por HTTP
+Cada câmera publica o JPEG mais recente uma única vez; cada espectador tem
+seu próprio slot "último frame vence", então um navegador lento perde frames
+em vez de acumular fila (e não atrasa os outros). A entrada da câmera só
+existe enquanto há espectadores: sai do hub quando o último se desconecta.
+
+O MJPEG não tem canal de metadados; no modo 'metadata' (e nas prévias do
+modo edge) o app desenha as caixas em um JPEG à parte só para o MJPEG.
+"""
+
+import threading
+
+BOUNDARY = 'frame'
+
+
+class ViewerSlot:
+    """Slot de um espectador: guarda só o frame mais recente ainda não enviado"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.jpeg = None
+        self.dropped = 0
+
+    def put(self, jpeg):
+        with self.condition:
+            if self.jpeg is not None:
+                self.dropped += 1  # O anterior não chegou a sair: descarta
+            self.jpeg = jpeg
+            self.condition.notify()
+
+    def take(self, timeout=None):
+        """Espera e retira o frame mais recente (None se o tempo acabar)"""
+        with self.condition:
+            if self.jpeg is None:
+                self.condition.wait(timeout)
+            jpeg, self.jpeg = self.jpeg, None
+            return jpeg
+
+
+class CameraBroadcast:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = None
+        self.viewers = set()
+
+    def publish(self, jpeg):
+        with self.lock:
+            self.latest = jpeg
+            viewers = list(self.viewers)
+        for slot in viewers:
+            slot.put(jpeg)
+
+    def subscribe(self):
+        slot = ViewerSlot()
+        with self.lock:
+            self.viewers.add(slot)
+            if self.latest is not None:
+                slot.put(self.latest)  # Novo espectador já começa com a última imagem
+        return slot
+
+    def unsubscribe(self, slot):
+        with self.lock:
+            self.viewers.discard(slot)
+
+
+class MJPEGHub:
+    def __init__(self, idle_timeout=5.0):
+        self.idle_timeout = idle_timeout  # Espera máxima por frame antes de reenviar o último
+        self.cameras = {}
+        self.lock = threading.Lock()
+
+    def _subscribe(self, camera_id):
+        """Inscreve um espectador, criando a entrada da câmera se preciso"""
+        with self.lock:
+            broadcast = self.cameras.get(camera_id)
+            if broadcast is None:
+                broadcast = self.cameras[camera_id] = CameraBroadcast()
+            return broadcast, broadcast.subscribe()
+
+    def _unsubscribe(self, camera_id, broadcast, slot):
+        """Remove o espectador e a entrada da câmera quando era o último"""
+        with self.lock:
+            broadcast.unsubscribe(slot)
+            if not broadcast.viewers and self.cameras.get(camera_id) is broadcast:
+                del self.cameras[camera_id]
+
+    def publish(self, camera_id, jpeg):
+        """Publica o JPEG (bytes) mais recente da câmera para todos os espectadores"""
+        with self.lock:
+            broadcast = self.cameras.get(camera_id)
+        if broadcast is not None:
+            broadcast.publish(bytes(jpeg))
+
+    def viewer_count(self, camera_id):
+        with self.lock:
+            broadcast = self.cameras.get(camera_id)
+        if broadcast is None:
+            return 0
+        with broadcast.lock:
+            return len(broadcast.viewers)
+
+    def stream(self, camera_id):
+        """Gerador com as partes multipart de um espectador (para Response do Flask)"""
+        broadcast, slot = self._subscribe(camera_id)
+        try:
+            while True:
+                jpeg = slot.take(self.idle_timeout)
+                if jpeg is None:
+                    # Câmera parada: reenvia a última imagem (mantém a conexão viva
+                    # e detecta espectadores que já foram embora)
+                    jpeg = broadcast.latest
+                    if jpeg is None:
+                        continue
+                yield (b'--' + BOUNDARY.encode() + b'\r\n'
+                       b'Content-Type: image/jpeg\r\n'
+                       b'Content-Length: ' + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            self._unsubscribe(camera_id, broadcast, slot)
@@ -30,9 +30,12 @@ class Camera(db.Model):
     name = db.Column(db.String(120), nullable=False)
     camera_source = db.Column(db.String(255), nullable=False)
     establishment_id = db.Column(db.Integer, db.ForeignKey('establishments.id'), nullable=False)
+    motion_threshold = db.Column(db.Float, nullable=True)  # % de pixels alterados para rodar a detecção (vazio = padrão)
+    min_face_size = db.Column(db.Integer, nullable=True)  # Menor rosto esperado em px; define a escala de detecção
     
     # Relacionamentos
     sightings = db.relationship('Sighting', backref='camera', lazy=True, cascade='all, delete-orphan')
+    sighting_rollups = db.relationship('SightingRollup', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
 class KnownFace(db.Model):
     __tablename__ = 'known_faces'
@@ -43,6 +46,7 @@ class KnownFace(db.Model):
     
     # Relacionamentos
     sightings = db.relationship('Sighting', backref='face', lazy=True, cascade='all, delete-orphan')
+    sighting_rollups = db.relationship('SightingRollup', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def get_face_encoding(self):
         """Converte o BLOB em numpy array"""
@@ -54,7 +58,32 @@ class KnownFace(db.Model):
 
 class Sighting(db.Model):
     __tablename__ = 'sightings'
+    # Índices para o histórico ordenado por data (paginação por cursor) e filtros por rosto/câmera
+    __table_args__ = (
+        db.Index('ix_sightings_timestamp', 'timestamp'),
+        db.Index('ix_sightings_face_timestamp', 'face_id', 'timestamp'),
+        db.Index('ix_sightings_camera_timestamp', 'camera_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     face_id = db.Column(db.Integer, db.ForeignKey('known_faces.id'), nullable=False)
     camera_id = db.Column(db.Integer, db.ForeignKey('cameras.id'), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class SightingRollup(db.Model):
+    """Contagem de avistamentos por rosto, câmera e hora (mantida pelo gravador de avistamentos)"""
+    __tablename__ = 'sighting_rollups_hourly'
+    face_id = db.Column(db.Integer, db.ForeignKey('known_faces.id', ondelete='CASCADE'), primary_key=True)
+    camera_id = db.Column(db.Integer, db.ForeignKey('cameras.id', ondelete='CASCADE'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)  # Início da hora (UTC)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.Index('ix_sighting_rollups_hour', 'hour'),
+        db.Index('ix_sighting_rollups_camera_hour', 'camera_id', 'hour'),
+    )
+
+
+class GalleryVersion(db.Model):
+    """Contador de mudanças da galeria de rostos do usuário (versão do snapshot em disco)"""
+    __tablename__ = 'gallery_versions'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
@@ -0,0 +1,53 @@
+"""
+Filtro de movimento barato para decidir se vale a pena rodar a detecção de rostos
+Compara um frame minúsculo em tons de cinza com um fundo de média móvel;
+cenas estáticas (corredores vazios) não vão para engine.process_frame.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, threshold_percent=0.5, pixel_delta=25, width=64, background_rate=0.05,
+                 max_skip_seconds=5.0):
+        self.threshold_percent = threshold_percent  # % mínimo de pixels alterados (0 desativa o filtro)
+        self.pixel_delta = pixel_delta  # Diferença de intensidade para um pixel contar como alterado
+        self.width = width  # Largura do frame reduzido usado na comparação
+        self.background_rate = background_rate  # Velocidade de adaptação do fundo
+        self.max_skip_seconds = max_skip_seconds  # Força uma detecção mesmo em cena parada
+        self.background = None
+        self.last_detection_time = 0.0
+        self.last_change_percent = 0.0
+        self.stats = {'checked': 0, 'skipped': 0}
+
+    def _tiny_gray(self, frame):
+        height = max(1, int(frame.shape[0] * self.width / frame.shape[1]))
+        tiny = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(tiny, cv2.COLOR_BGR2GRAY) if tiny.ndim == 3 else tiny
+        return cv2.GaussianBlur(gray, (3, 3), 0).astype(np.float32)
+
+    def should_process(self, frame):
+        """Retorna True se o frame mudou o suficiente para rodar a detecção"""
+        self.stats['checked'] += 1
+        gray = self._tiny_gray(frame)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            self.last_detection_time = time.monotonic()
+            return True
+
+        changed = np.count_nonzero(np.abs(gray - self.background) > self.pixel_delta)
+        self.last_change_percent = 100.0 * changed / gray.size
+        cv2.accumulateWeighted(gray, self.background, self.background_rate)
+
+        now = time.monotonic()
+        if (self.threshold_percent <= 0 or self.last_change_percent >= self.threshold_percent
+                or now - self.last_detection_time >= self.max_skip_seconds):
+            self.last_detection_time = now
+            return True
+
+        self.stats['skipped'] += 1
+        return False
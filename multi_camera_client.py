@@ -0,0 +1,251 @@
+"""
+Cliente multi-câmera em um único processo
+Em vez de um camera_client.py (interpretador, OpenCV e conexão) por câmera,
+atende várias fontes: uma thread de captura por fonte, codificação em um pool
+de threads (o OpenCV libera o GIL) e uma única conexão Socket.IO assíncrona
+(asyncio) multiplexando todas as câmeras.
+
+Requer o cliente assíncrono do python-socketio (pip install aiohttp).
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import socketio
+
+import camera_client
+from camera_client import AdaptiveBitrate, EdgeRecognizer, FlowControl, LatestSlot, StageRate, grab_frames
+
+SERVER_ADDR = "http://localhost:5000"
+CONFIG_FILE = "cameras_config.json"
+
+sio = socketio.AsyncClient(reconnection=True)
+streams = {}  # camera_id -> CameraStream
+
+
+class CameraStream:
+    """Estado de uma fonte: captura própria, controle de fluxo e de taxa próprios"""
+
+    def __init__(self, camera_id, source):
+        self.camera_id = camera_id
+        self.source = source
+        self.cap = None
+        self.grab_thread = None
+        self.raw_slot = LatestSlot()
+        self.stop_event = threading.Event()
+        self.flow = FlowControl(camera_client.MAX_IN_FLIGHT, camera_client.ACK_TIMEOUT)
+        self.bitrate = AdaptiveBitrate(camera_client.FPS, target_latency=camera_client.TARGET_LATENCY,
+                                       min_width=camera_client.MIN_WIDTH, enabled=camera_client.ADAPTIVE)
+        self.edge = None
+        self.rates = {name: StageRate(name) for name in ('captura', 'codificação', 'envio')}
+        self.dropped = 0
+
+    def open(self):
+        try:
+            source = int(self.source)
+        except ValueError:
+            source = self.source
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            print(f"Erro: Não foi possível abrir a fonte de vídeo {self.source} (câmera {self.camera_id})")
+            return False
+        if camera_client.MODE == 'edge':
+            self.edge = EdgeRecognizer(camera_client.MIN_FACE_SIZE, camera_client.PREVIEW_INTERVAL,
+                                       camera_client.PREVIEW_WIDTH)
+        self.grab_thread = threading.Thread(target=grab_frames,
+                                            args=(self.cap, self.raw_slot, self.stop_event, self.rates),
+                                            name=f"captura-{self.camera_id}", daemon=True)
+        self.grab_thread.start()
+        return True
+
+    def close(self, timeout=2.0):
+        self.stop_event.set()
+        # Só libera a captura depois que a thread sair do cap.read()
+        if self.grab_thread is not None:
+            self.grab_thread.join(timeout)
+            if self.grab_thread.is_alive():
+                print(f"Captura da câmera {self.camera_id} não respondeu; a fonte será liberada ao sair")
+                return
+        if self.cap is not None:
+            self.cap.release()
+
+
+def encode_jpeg(frame, quality, scale):
+    if scale < 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return buffer
+
+
+@sio.event
+async def connect():
+    print('Conectado ao servidor!')
+    # (Re)inicia as câmeras no servidor a cada conexão
+    for camera_id in streams:
+        await sio.emit('start_camera', {'camera_id': camera_id, 'client_driven': camera_client.MODE == 'edge'})
+
+
+@sio.event
+async def disconnect():
+    print('Desconectado do servidor.')
+    for stream in streams.values():
+        stream.flow.reset()  # Acks pendentes não vão mais chegar
+
+
+async def run_camera(stream, executor):
+    """Laço de uma câmera: pega o frame mais novo, codifica no pool e envia pela conexão única"""
+    loop = asyncio.get_running_loop()
+    next_time = time.monotonic()
+    fps = camera_client.FPS
+
+    while not stream.stop_event.is_set():
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        next_time = max(next_time + 1/fps, time.monotonic())
+
+        item = stream.raw_slot.take(timeout=0)
+        if item is None or not sio.connected:
+            continue
+        sequence, capture_time, frame = item
+        quality, scale, fps = stream.bitrate.settings(frame.shape[1])
+
+        # Sem crédito: descarta o frame (o próximo, mais novo, ocupa o lugar dele)
+        if not stream.flow.acquire(sequence):
+            stream.dropped += 1
+            stream.bitrate.record_drop()
+            continue
+
+        on_ack = lambda *args, s=stream, seq=sequence: s.bitrate.record_ack(s.flow.ack(seq))
+        try:
+            if stream.edge is not None:
+                payload = await loop.run_in_executor(executor, stream.edge.detections, frame, sequence, capture_time)
+                stream.rates['codificação'].tick()
+                payload['camera_id'] = stream.camera_id
+                await sio.emit('detections', payload, callback=on_ack)
+                size = len(payload['locations']) * (16 + 512) + len(payload.get('preview') or b'')
+            else:
+                buffer = await loop.run_in_executor(executor, encode_jpeg, frame, quality, scale)
+                stream.rates['codificação'].tick()
+                if camera_client.TRANSPORT == 'binary':
+                    image = buffer.tobytes()
+                else:
+                    image = f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+                await sio.emit('stream', {
+                    'image': image,
+                    'camera_id': stream.camera_id,
+                    'timestamp': capture_time,
+                    'sequence': sequence
+                }, callback=on_ack)
+                size = len(buffer)
+        except Exception as e:
+            stream.flow.cancel(sequence)
+            print(f"Erro no envio da câmera {stream.camera_id}: {e}")
+            continue
+
+        stream.bitrate.record_sent(size)
+        stream.rates['envio'].tick()
+
+    print(f"Stream da câmera {stream.camera_id} encerrado")
+
+
+async def report_loop():
+    """Log a cada 10 segundos com a taxa de cada câmera"""
+    while True:
+        await asyncio.sleep(10)
+        for camera_id, stream in streams.items():
+            rates = " | ".join(f"{name}: {rate.rate():.1f} fps" for name, rate in stream.rates.items())
+            print(f"[câmera {camera_id}] {rates} | descartados: {stream.dropped} | "
+                  f"em trânsito: {len(stream.flow.in_flight)}")
+
+
+async def run(cameras, server):
+    for camera in cameras:
+        stream = CameraStream(int(camera['id']), camera['source'])
+        if stream.open():
+            streams[stream.camera_id] = stream
+            print(f"Iniciando stream da câmera {stream.camera_id} (fonte: {stream.source})")
+
+    if not streams:
+        print("Nenhuma câmera pôde ser aberta")
+        return
+
+    executor = ThreadPoolExecutor(max_workers=min(len(streams), 8), thread_name_prefix="codificacao")
+    try:
+        await sio.connect(server)
+        reporter = asyncio.create_task(report_loop())
+        await asyncio.gather(*(run_camera(stream, executor) for stream in streams.values()))
+        reporter.cancel()
+    finally:
+        for camera_id, stream in streams.items():
+            stream.close()
+            if sio.connected:
+                await sio.emit('stop_camera', {'camera_id': camera_id})
+        executor.shutdown(wait=False)
+        await sio.disconnect()
+
+
+def load_cameras(config_file):
+    """Lê o mesmo cameras_config.json usado pelo camera_manager.py"""
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+    return config.get('cameras', []), config.get('server')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cliente multi-câmera (um processo para várias fontes)')
+    parser.add_argument('--config', default=None,
+                       help=f'Arquivo de configuração das câmeras (ex: {CONFIG_FILE})')
+    parser.add_argument('--camera', action='append', default=[], metavar='ID=FONTE',
+                       help='Câmera extra no formato id=fonte (pode repetir)')
+    parser.add_argument('--server', default=None,
+                       help=f'Endereço do servidor (padrão: o da configuração ou {SERVER_ADDR})')
+    parser.add_argument('--fps', type=int, default=camera_client.FPS,
+                       help=f'Frames por segundo por câmera (padrão: {camera_client.FPS})')
+    parser.add_argument('--transport', choices=['binary', 'base64'], default=camera_client.TRANSPORT,
+                       help=f'Formato de envio dos frames (padrão: {camera_client.TRANSPORT})')
+    parser.add_argument('--max-in-flight', type=int, default=camera_client.MAX_IN_FLIGHT,
+                       help=f'Frames aguardando confirmação, por câmera (padrão: {camera_client.MAX_IN_FLIGHT})')
+    parser.add_argument('--no-adaptive', action='store_true',
+                       help='Desativa o ajuste automático de qualidade/resolução/FPS')
+    parser.add_argument('--mode', choices=['frames', 'edge'], default=camera_client.MODE,
+                       help=f'frames = envia o vídeo; edge = detecta/encoda localmente (padrão: {camera_client.MODE})')
+
+    args = parser.parse_args()
+
+    # As classes reaproveitadas do camera_client leem a configuração do módulo
+    camera_client.FPS = args.fps
+    camera_client.TRANSPORT = args.transport
+    camera_client.MAX_IN_FLIGHT = max(1, args.max_in_flight)
+    camera_client.ADAPTIVE = not args.no_adaptive
+    camera_client.MODE = args.mode
+
+    cameras, server = [], None
+    if args.config:
+        cameras, server = load_cameras(args.config)
+    for spec in args.camera:
+        camera_id, _, source = spec.partition('=')
+        cameras.append({'id': int(camera_id), 'source': source})
+    server = args.server or server or SERVER_ADDR
+
+    if not cameras:
+        parser.error("informe --config ou pelo menos um --camera id=fonte")
+
+    print(f"Conectando ao servidor: {server}")
+    print(f"Câmeras: {', '.join(str(camera['id']) for camera in cameras)}")
+    print(f"FPS: {camera_client.FPS} | Transporte: {camera_client.TRANSPORT} | Modo: {camera_client.MODE}")
+
+    try:
+        asyncio.run(run(cameras, server))
+    except KeyboardInterrupt:
+        print("\nParando streams...")
+
+
+if __name__ == '__main__':
+    main()
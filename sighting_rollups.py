@@ -0,0 +1,136 @@
+"""
+Agregados por hora dos avistamentos (rosto x câmera x hora)
+Mantidos incrementalmente pelo gravador de avistamentos, na mesma transação
+do INSERT; estatísticas e séries temporais leem daqui em vez de varrer a
+tabela de avistamentos. Use backfill() (backfill_rollups.py) para reconstruir.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, Sighting, SightingRollup, KnownFace, Camera
+
+
+def hour_bucket(timestamp):
+    """Início da hora do timestamp"""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def aggregate(rows):
+    """Conta as linhas (dicts ou Sighting) por (face_id, camera_id, hora)"""
+    counts = Counter()
+    for row in rows:
+        if isinstance(row, dict):
+            counts[(row['face_id'], row['camera_id'], hour_bucket(row['timestamp']))] += 1
+        else:
+            counts[(row.face_id, row.camera_id, hour_bucket(row.timestamp))] += 1
+    return counts
+
+
+def add_counts(session, counts):
+    """Soma as contagens nos agregados (upsert); não faz commit"""
+    if not counts:
+        return
+
+    values = [
+        {'face_id': face_id, 'camera_id': camera_id, 'hour': hour, 'count': count}
+        for (face_id, camera_id, hour), count in counts.items()
+    ]
+    table = SightingRollup.__table__
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(values)
+        session.execute(statement.on_duplicate_key_update(count=table.c.count + statement.inserted['count']))
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(values)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=['face_id', 'camera_id', 'hour'],
+            set_={'count': table.c.count + statement.excluded['count']}
+        ))
+    else:
+        for value in values:
+            rollup = session.get(SightingRollup, (value['face_id'], value['camera_id'], value['hour']))
+            if rollup is None:
+                session.add(SightingRollup(**value))
+            else:
+                rollup.count += value['count']
+
+
+def backfill(since=None, chunk_size=50000):
+    """Reconstrói os agregados a partir dos avistamentos (desde `since`, ou tudo)
+
+    Percorre os avistamentos por id em blocos (keyset) para não carregar a
+    tabela inteira; deve rodar em um app context. Retorna quantos avistamentos
+    foram agregados.
+    """
+    rollups = SightingRollup.query
+    sightings = db.session.query(Sighting.id, Sighting.face_id, Sighting.camera_id, Sighting.timestamp)
+    if since is not None:
+        since = hour_bucket(since)
+        rollups = rollups.filter(SightingRollup.hour >= since)
+        sightings = sightings.filter(Sighting.timestamp >= since)
+    rollups.delete(synchronize_session=False)
+
+    total = 0
+    last_id = 0
+    while True:
+        chunk = sightings.filter(Sighting.id > last_id).order_by(Sighting.id).limit(chunk_size).all()
+        if not chunk:
+            break
+        add_counts(db.session, aggregate(chunk))
+        db.session.commit()
+        total += len(chunk)
+        last_id = chunk[-1].id
+        print(f"  {total} avistamentos agregados...")
+
+    db.session.commit()
+    return total
+
+
+def _user_rollups(user_id, since, face_id=None, camera_id=None):
+    query = SightingRollup.query.join(KnownFace, SightingRollup.face_id == KnownFace.id).filter(
+        KnownFace.user_id == user_id,
+        SightingRollup.hour >= hour_bucket(since)
+    )
+    if face_id is not None:
+        query = query.filter(SightingRollup.face_id == face_id)
+    if camera_id is not None:
+        query = query.filter(SightingRollup.camera_id == camera_id)
+    return query
+
+
+def recent_count(user_id, hours=24):
+    """Avistamentos das últimas `hours` horas (inclui a hora corrente inteira)"""
+    since = datetime.utcnow() - timedelta(hours=hours - 1)
+    total = _user_rollups(user_id, since).with_entities(func.sum(SightingRollup.count)).scalar()
+    return int(total or 0)
+
+
+def hourly_series(user_id, hours=24, face_id=None, camera_id=None):
+    """Série por hora das últimas `hours` horas, com zeros nas horas sem avistamentos"""
+    start = hour_bucket(datetime.utcnow()) - timedelta(hours=hours - 1)
+    rows = _user_rollups(user_id, start, face_id, camera_id).with_entities(
+        SightingRollup.hour, func.sum(SightingRollup.count)
+    ).group_by(SightingRollup.hour).all()
+    counts = {hour: int(count) for hour, count in rows}
+    return [
+        {'hour': (start + timedelta(hours=i)).isoformat(), 'count': counts.get(start + timedelta(hours=i), 0)}
+        for i in range(hours)
+    ]
+
+
+def camera_totals(user_id, hours=24):
+    """Avistamentos por câmera nas últimas `hours` horas"""
+    since = datetime.utcnow() - timedelta(hours=hours - 1)
+    rows = _user_rollups(user_id, since).join(Camera, SightingRollup.camera_id == Camera.id).with_entities(
+        Camera.id, Camera.name, func.sum(SightingRollup.count)
+    ).group_by(Camera.id, Camera.name).all()
+    return [{'camera_id': camera_id, 'camera_name': name, 'count': int(count)} for camera_id, name, count in rows]
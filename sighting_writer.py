@@ -0,0 +1,217 @@
+"""
+Gravação assíncrona (write-behind) dos avistamentos
+O caminho de detecção só enfileira; uma thread em segundo plano grava em lote
+com um INSERT de várias linhas a cada N avistamentos ou T milissegundos, e
+atualiza os agregados por hora (sighting_rollups) na mesma transação. Depois
+do commit invalida o cache de estatísticas dos usuários afetados.
+
+Fila cheia (banco lento ou fora do ar), conforme a política configurada:
+- drop_oldest: descarta o avistamento mais antigo da fila (padrão)
+- drop_new: recusa o novo avistamento
+- block: espera até block_timeout por espaço e então recusa
+No encerramento a fila é gravada até shutdown_timeout; o que sobrar é contado
+como descartado.
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_new', 'block')
+
+
+class SightingWriter:
+    def __init__(self, app, batch_size=200, flush_interval=0.5, max_queue=10000,
+                 overflow='drop_oldest', block_timeout=0.1, max_retries=3, shutdown_timeout=5.0):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de estouro inválida: {overflow}")
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # Segundos máximos entre o enfileiramento e a gravação
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.max_retries = max_retries  # Tentativas de um lote antes de descartá-lo
+        self.shutdown_timeout = shutdown_timeout
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        self.stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'failures': 0}
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="sighting-writer", daemon=True)
+            self.thread.start()
+        print(f"Gravador de avistamentos iniciado (lote {self.batch_size}, "
+              f"{self.flush_interval * 1000:.0f} ms, fila {self.max_queue}, {self.overflow})")
+
+    def enqueue(self, face_id, camera_id, timestamp, user_id=None):
+        """Enfileira um avistamento; retorna False se ele foi recusado"""
+        if self.thread is None:
+            self.start()
+
+        row = {'face_id': face_id, 'camera_id': camera_id, 'timestamp': timestamp}
+        with self.condition:
+            if self.stopping:
+                self.stats['dropped'] += 1
+                return False
+
+            if len(self.queue) >= self.max_queue:
+                if self.overflow == 'drop_oldest':
+                    self.queue.popleft()
+                    self.stats['dropped'] += 1
+                elif self.overflow == 'block':
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self.queue) >= self.max_queue:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                if len(self.queue) >= self.max_queue:
+                    self.stats['dropped'] += 1
+                    return False
+
+            self.queue.append((row, user_id))
+            self.stats['enqueued'] += 1
+            if len(self.queue) >= self.batch_size:
+                self.condition.notify_all()
+            return True
+
+    def _take_batch(self):
+        """Espera um lote cheio ou o prazo do avistamento mais antigo"""
+        with self.condition:
+            while not self.queue and not self.stopping:
+                self.condition.wait()
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(self.queue) < self.batch_size and not self.stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            self.condition.notify_all()  # Libera quem espera por espaço (política 'block')
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            with self.condition:
+                if self.stopping and not self.queue:
+                    return
+
+    def _write(self, batch):
+        """Grava o lote com um único INSERT de várias linhas (e os agregados por hora)"""
+        from sqlalchemy.exc import IntegrityError
+        from models import db, Sighting
+        import sighting_rollups
+        import stats_cache
+
+        attempt = 0
+        while attempt < self.max_retries:
+            attempt += 1
+            with self.app.app_context():
+                try:
+                    rows = [row for row, _ in batch]
+                    db.session.execute(Sighting.__table__.insert().values(rows))
+                    sighting_rollups.add_counts(db.session, sighting_rollups.aggregate(rows))  # Mesma transação
+                    db.session.commit()
+                    self.stats['written'] += len(batch)
+                    self.stats['batches'] += 1
+                    for user_id in {user_id for _, user_id in batch}:
+                        stats_cache.invalidate(user_id)
+                    return True
+                except IntegrityError as e:
+                    db.session.rollback()
+                    # Rosto ou câmera excluído enquanto o avistamento estava na fila: descarta só
+                    # esses avistamentos (chave estrangeira) e grava o resto do lote
+                    try:
+                        valid = self._drop_orphans(batch)
+                    except Exception:
+                        db.session.rollback()
+                        valid = batch
+                    if len(valid) < len(batch):
+                        print(f"{len(batch) - len(valid)} avistamentos descartados (rosto ou câmera excluído)")
+                        self.stats['dropped'] += len(batch) - len(valid)
+                        batch = valid
+                        if not batch:
+                            return False
+                        attempt -= 1  # Não conta como tentativa: regrava já o restante
+                        continue
+                    self.stats['failures'] += 1
+                    print(f"Erro ao gravar {len(batch)} avistamentos (tentativa {attempt}): {e}")
+                except Exception as e:
+                    db.session.rollback()
+                    self.stats['failures'] += 1
+                    print(f"Erro ao gravar {len(batch)} avistamentos (tentativa {attempt}): {e}")
+            if self.stopping:
+                break
+            time.sleep(min(2.0, 0.1 * 2 ** attempt))
+
+        self.stats['dropped'] += len(batch)
+        return False
+
+    def _drop_orphans(self, batch):
+        """Itens do lote cujo rosto e câmera ainda existem (chamar em um app context)"""
+        from models import KnownFace, Camera
+
+        face_ids = {row['face_id'] for row, _ in batch}
+        camera_ids = {row['camera_id'] for row, _ in batch}
+        existing_faces = {face_id for (face_id,) in KnownFace.query.with_entities(KnownFace.id)
+                          .filter(KnownFace.id.in_(face_ids))}
+        existing_cameras = {camera_id for (camera_id,) in Camera.query.with_entities(Camera.id)
+                            .filter(Camera.id.in_(camera_ids))}
+        return [item for item in batch
+                if item[0]['face_id'] in existing_faces and item[0]['camera_id'] in existing_cameras]
+
+    def shutdown(self):
+        """Grava o que está na fila (até shutdown_timeout) e encerra a thread"""
+        with self.condition:
+            if self.thread is None or self.stopping:
+                return
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(self.shutdown_timeout)
+
+        with self.condition:
+            if self.queue:
+                print(f"{len(self.queue)} avistamentos descartados no encerramento")
+                self.stats['dropped'] += len(self.queue)
+                self.queue.clear()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure_writer(app):
+    """Cria o gravador global a partir da configuração da aplicação"""
+    global _writer
+    if _writer is not None:
+        _writer.shutdown()
+
+    _writer = SightingWriter(
+        app,
+        batch_size=app.config.get('SIGHTING_BATCH_SIZE', 200),
+        flush_interval=app.config.get('SIGHTING_FLUSH_MS', 500) / 1000.0,
+        max_queue=app.config.get('SIGHTING_QUEUE_SIZE', 10000),
+        overflow=app.config.get('SIGHTING_OVERFLOW', 'drop_oldest')
+    )
+    _writer.start()
+    atexit.register(_writer.shutdown)
+    return _writer
+
+
+def get_writer(app):
+    """Gravador atual (criado com a configuração de app na primeira chamada)"""
+    with _writer_lock:
+        if _writer is None:
+            return configure_writer(app)
+        return _writer
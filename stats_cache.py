@@ -0,0 +1,125 @@
+"""
+Cache de estatísticas por usuário com envio por push
+As estatísticas que dependem do banco ficam em cache até uma escrita relevante
+(avistamentos, rostos, câmeras) invalidar o usuário; uma thread recalcula os
+usuários com painel aberto e envia pelo 'stats_update' só o que mudou. O custo
+no banco não depende de quantas abas estão abertas.
+"""
+
+import atexit
+import threading
+import time
+from collections import Counter
+
+
+class StatsCache:
+    def __init__(self, app, compute_db, compute_live, publish, push_interval=1.0, max_age=60.0):
+        self.app = app
+        self.compute_db = compute_db  # user_id -> dict (consultas ao banco, em cache)
+        self.compute_live = compute_live  # user_id -> dict (estado em memória, barato)
+        self.publish = publish  # (user_id, delta) -> envia aos painéis do usuário
+        self.push_interval = push_interval  # Agrupa várias invalidações em um único recálculo
+        self.max_age = max_age  # Recalcula mesmo sem escrita (janela de 24h anda com o tempo)
+        self.entries = {}  # user_id -> (estatísticas do banco, instante do cálculo)
+        self.last_pushed = {}  # user_id -> último estado enviado
+        self.dirty = set()
+        self.subscribers = Counter()  # user_id -> conexões com painel aberto
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'computed': 0, 'hits': 0, 'pushes': 0}
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="stats-cache", daemon=True)
+            self.thread.start()
+
+    def _db_stats(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and user_id not in self.dirty and now - entry[1] < self.max_age:
+                self.stats['hits'] += 1
+                return entry[0]
+            self.dirty.discard(user_id)
+
+        stats = self.compute_db(user_id)
+        with self.lock:
+            self.entries[user_id] = (stats, now)
+            self.stats['computed'] += 1
+        return stats
+
+    def get(self, user_id):
+        """Estatísticas completas do usuário (banco em cache + estado ao vivo)"""
+        stats = dict(self._db_stats(user_id))
+        stats.update(self.compute_live(user_id))
+        return stats
+
+    def invalidate(self, user_id):
+        """Marca o usuário para recálculo (chamado nas escritas)"""
+        with self.lock:
+            self.dirty.add(user_id)
+
+    def subscribe(self, user_id):
+        """Conexão de painel aberta; retorna as estatísticas atuais para o envio inicial"""
+        stats = self.get(user_id)
+        with self.lock:
+            self.subscribers[user_id] += 1
+            self.last_pushed[user_id] = stats
+        return stats
+
+    def unsubscribe(self, user_id):
+        with self.lock:
+            self.subscribers[user_id] -= 1
+            if self.subscribers[user_id] <= 0:
+                del self.subscribers[user_id]
+                self.last_pushed.pop(user_id, None)
+
+    def _run(self):
+        while not self.stop_event.wait(self.push_interval):
+            with self.lock:
+                users = list(self.subscribers)
+            for user_id in users:
+                try:
+                    with self.app.app_context():
+                        self._push(user_id)
+                except Exception as e:
+                    print(f"Erro ao atualizar estatísticas do usuário {user_id}: {e}")
+
+    def _push(self, user_id):
+        stats = self.get(user_id)
+        with self.lock:
+            previous = self.last_pushed.get(user_id, {})
+            delta = {key: value for key, value in stats.items() if previous.get(key) != value}
+            if not delta or user_id not in self.subscribers:
+                return
+            self.last_pushed[user_id] = stats
+            self.stats['pushes'] += 1
+        self.publish(user_id, delta)
+
+    def shutdown(self):
+        self.stop_event.set()
+
+
+_cache = None
+
+
+def configure_cache(app, compute_db, compute_live, publish, **kwargs):
+    """Cria o cache global e inicia a thread de envio"""
+    global _cache
+    if _cache is not None:
+        _cache.shutdown()
+    _cache = StatsCache(app, compute_db, compute_live, publish, **kwargs)
+    _cache.start()
+    atexit.register(_cache.shutdown)
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+def invalidate(user_id):
+    """Invalida as estatísticas do usuário (sem efeito se o cache não estiver configurado)"""
+    if _cache is not None and user_id is not None:
+        _cache.invalidate(user_id)
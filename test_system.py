@@ -57,7 +57,21 @@ def test_files():
         'models.py', 
         'forms.py',
         'face_recognition_engine.py',
+        'face_gallery.py',
+        'inference_batcher.py',
+        'detection_backend.py',
+        'frame_ring.py',
+        'face_tracker.py',
+        'motion_detector.py',
+        'detection_scheduler.py',
+        'mjpeg_stream.py',
+        'sighting_writer.py',
+        'sighting_rollups.py',
+        'backfill_rollups.py',
+        'stats_cache.py',
+        'gallery_snapshot.py',
         'camera_client.py',
+        'multi_camera_client.py',
         'requirements.txt',
         'sdd_project',
         '.env',